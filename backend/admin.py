@@ -3,6 +3,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_admin import Admin, AdminIndexView, expose
 from flask_admin.contrib.sqla import ModelView
 from flask_login import LoginManager, UserMixin, login_user, logout_user, current_user, login_required
+from sqlalchemy import text
 from database import engine
 from models import (Base, Document, DocumentType, Discipline, RevisionStatus, RevisionStep, Project, Company, Facility,
                     Language, RevisionDescription, User)
@@ -34,6 +35,21 @@ class MyModelView(ModelView):
     def inaccessible_callback(self, name, **kwargs):
         return redirect(url_for('login', next=request.url))
 
+    # Оповещаем API об изменении справочника, чтобы он сбросил свой кэш.
+    # Для пользователя передается id, чтобы API сбросил только его закэшированные права
+    def notify_change(self, model):
+        payload = model.__tablename__
+        if isinstance(model, User):
+            payload = f'{payload}:{model.id}'
+        self.session.execute(text("SELECT pg_notify('reference_data', :payload)"), {'payload': payload})
+        self.session.commit()
+
+    def after_model_change(self, form, model, is_created):
+        self.notify_change(model)
+
+    def after_model_delete(self, model):
+        self.notify_change(model)
+
 
 class MyAdminIndexView(AdminIndexView):
     @expose('/')
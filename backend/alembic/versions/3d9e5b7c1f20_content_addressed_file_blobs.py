@@ -0,0 +1,74 @@
+"""Content-addressed file blobs
+
+Revision ID: 3d9e5b7c1f20
+Revises: 8c3f1a9d2b47
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3d9e5b7c1f20'
+down_revision: Union[str, None] = '8c3f1a9d2b47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('file_blobs',
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=True),
+    sa.Column('ref_count', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('created', sa.DateTime(timezone=True), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=True),
+    sa.Column('released', sa.DateTime(timezone=True), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=True),
+    sa.PrimaryKeyConstraint('sha256')
+    )
+    op.create_index('ix_file_blobs_unreferenced', 'file_blobs', ['released'], unique=False,
+                    postgresql_where=sa.text('ref_count <= 0'))
+    # document_id есть в рабочей базе, но отсутствовал в начальной миграции
+    op.execute('ALTER TABLE uploaded_files ADD COLUMN IF NOT EXISTS document_id integer')
+    op.add_column('uploaded_files', sa.Column('sha256', sa.String(length=64), nullable=True))
+    op.add_column('uploaded_files', sa.Column('file_name', sa.String(length=512), nullable=True))
+    op.create_index(op.f('ix_uploaded_files_sha256'), 'uploaded_files', ['sha256'], unique=False)
+    op.create_index('ix_uploaded_files_document_id', 'uploaded_files', ['document_id'], unique=False,
+                    if_not_exists=True)
+
+    # Счетчик ссылок на блоб ведется триггером: учитываются только неудаленные строки uploaded_files
+    op.execute('''
+        CREATE FUNCTION uploaded_files_blob_refs() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.sha256 IS NOT NULL AND COALESCE(OLD.deleted, 0) = 0 THEN
+                UPDATE file_blobs
+                SET ref_count = ref_count - 1,
+                    released = CURRENT_TIMESTAMP
+                WHERE sha256 = OLD.sha256;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.sha256 IS NOT NULL AND COALESCE(NEW.deleted, 0) = 0 THEN
+                INSERT INTO file_blobs (sha256, ref_count)
+                VALUES (NEW.sha256, 1)
+                ON CONFLICT (sha256) DO UPDATE SET ref_count = file_blobs.ref_count + 1;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    op.execute('''
+        CREATE TRIGGER uploaded_files_blob_refs
+        AFTER INSERT OR DELETE OR UPDATE OF sha256, deleted ON uploaded_files
+        FOR EACH ROW EXECUTE FUNCTION uploaded_files_blob_refs()
+    ''')
+
+
+def downgrade() -> None:
+    op.execute('DROP TRIGGER uploaded_files_blob_refs ON uploaded_files')
+    op.execute('DROP FUNCTION uploaded_files_blob_refs()')
+    op.drop_index('ix_uploaded_files_document_id', table_name='uploaded_files', if_exists=True)
+    op.drop_index(op.f('ix_uploaded_files_sha256'), table_name='uploaded_files')
+    op.drop_column('uploaded_files', 'file_name')
+    op.drop_column('uploaded_files', 'sha256')
+    op.drop_index('ix_file_blobs_unreferenced', table_name='file_blobs')
+    op.drop_table('file_blobs')
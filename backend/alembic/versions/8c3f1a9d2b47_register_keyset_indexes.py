@@ -0,0 +1,31 @@
+"""Register keyset indexes
+
+Revision ID: 8c3f1a9d2b47
+Revises: 46e0f61bcfc0
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c3f1a9d2b47'
+down_revision: Union[str, None] = '46e0f61bcfc0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Частичные индексы под keyset-пагинацию реестра папки: (folder_id, ключ сортировки, id)
+    op.create_index('ix_documents_folder_id_id', 'documents', ['folder_id', 'id'], unique=False,
+                    postgresql_where=sa.text('deleted = 0'))
+    op.create_index('ix_documents_folder_id_number_id', 'documents', ['folder_id', 'number', 'id'], unique=False,
+                    postgresql_where=sa.text('deleted = 0'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_documents_folder_id_number_id', table_name='documents')
+    op.drop_index('ix_documents_folder_id_id', table_name='documents')
@@ -0,0 +1,88 @@
+"""Folder versions
+
+Revision ID: a4d7e2c9b583
+Revises: f2c8d4a6e931
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4d7e2c9b583'
+down_revision: Union[str, None] = 'f2c8d4a6e931'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Триггеры уровня оператора с таблицами переходов: папка получает одно увеличение версии на оператор,
+# а не на каждую строку (COPY при импорте тысяч документов обновляет folders один раз).
+# Таблицы переходов нельзя объявить у триггера на несколько событий, поэтому триггеров по три на таблицу.
+EVENTS = {
+    'INSERT': 'REFERENCING NEW TABLE AS new_rows',
+    'UPDATE': 'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows',
+    'DELETE': 'REFERENCING OLD TABLE AS old_rows',
+}
+
+
+def upgrade() -> None:
+    op.add_column('folders', sa.Column('version', sa.BigInteger(), server_default='0', nullable=False))
+
+    # Документы: меняется версия старой и новой папки (перенос документа затрагивает обе)
+    op.execute('''
+        CREATE FUNCTION documents_folder_version() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                UPDATE folders SET version = version + 1
+                WHERE id IN (SELECT folder_id FROM new_rows);
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE folders SET version = version + 1
+                WHERE id IN (SELECT folder_id FROM old_rows);
+            ELSE
+                UPDATE folders SET version = version + 1
+                WHERE id IN (SELECT folder_id FROM old_rows UNION SELECT folder_id FROM new_rows);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    # Файлы: меняется версия папки документа, к которому они прикреплены
+    op.execute('''
+        CREATE FUNCTION uploaded_files_folder_version() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                UPDATE folders SET version = version + 1
+                WHERE id IN (SELECT d.folder_id FROM documents d
+                             WHERE d.id IN (SELECT document_id FROM new_rows));
+            ELSIF TG_OP = 'DELETE' THEN
+                UPDATE folders SET version = version + 1
+                WHERE id IN (SELECT d.folder_id FROM documents d
+                             WHERE d.id IN (SELECT document_id FROM old_rows));
+            ELSE
+                UPDATE folders SET version = version + 1
+                WHERE id IN (SELECT d.folder_id FROM documents d
+                             WHERE d.id IN (SELECT document_id FROM old_rows
+                                            UNION SELECT document_id FROM new_rows));
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    for table in ('documents', 'uploaded_files'):
+        for event, referencing in EVENTS.items():
+            op.execute(f'''
+                CREATE TRIGGER {table}_folder_version_{event.lower()}
+                AFTER {event} ON {table}
+                {referencing}
+                FOR EACH STATEMENT EXECUTE FUNCTION {table}_folder_version()
+            ''')
+
+
+def downgrade() -> None:
+    for table in ('documents', 'uploaded_files'):
+        for event in EVENTS:
+            op.execute(f'DROP TRIGGER {table}_folder_version_{event.lower()} ON {table}')
+        op.execute(f'DROP FUNCTION {table}_folder_version()')
+    op.drop_column('folders', 'version')
@@ -0,0 +1,29 @@
+"""Uploaded files metadata
+
+Revision ID: b51c0e8a7d63
+Revises: 3d9e5b7c1f20
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b51c0e8a7d63'
+down_revision: Union[str, None] = '3d9e5b7c1f20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Размер и MIME-тип сохраняются при загрузке; для старых строк заполняются командой backfill_files.py
+    op.add_column('uploaded_files', sa.Column('file_size', sa.BigInteger(), nullable=True))
+    op.add_column('uploaded_files', sa.Column('mime_type', sa.String(length=255), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('uploaded_files', 'mime_type')
+    op.drop_column('uploaded_files', 'file_size')
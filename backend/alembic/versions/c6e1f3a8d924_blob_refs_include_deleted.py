@@ -0,0 +1,75 @@
+"""Blob refs include soft-deleted files
+
+Revision ID: c6e1f3a8d924
+Revises: a4d7e2c9b583
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c6e1f3a8d924'
+down_revision: Union[str, None] = 'a4d7e2c9b583'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Мягкое удаление (deleted = 1) обратимо, поэтому строка uploaded_files ссылается на блоб,
+# пока она существует: ссылка освобождается только настоящим DELETE строки
+REFS_FUNCTION = '''
+    CREATE OR REPLACE FUNCTION uploaded_files_blob_refs() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.sha256 IS NOT NULL {old_filter}THEN
+            UPDATE file_blobs
+            SET ref_count = ref_count - 1,
+                released = CURRENT_TIMESTAMP
+            WHERE sha256 = OLD.sha256;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.sha256 IS NOT NULL {new_filter}THEN
+            INSERT INTO file_blobs (sha256, ref_count)
+            VALUES (NEW.sha256, 1)
+            ON CONFLICT (sha256) DO UPDATE SET ref_count = file_blobs.ref_count + 1;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql
+'''
+
+RECOUNT = '''
+    UPDATE file_blobs b
+    SET ref_count = (SELECT count(*) FROM uploaded_files f WHERE f.sha256 = b.sha256 {filter}),
+        released = CURRENT_TIMESTAMP
+'''
+
+
+def upgrade() -> None:
+    op.execute('DROP TRIGGER uploaded_files_blob_refs ON uploaded_files')
+    op.execute(REFS_FUNCTION.format(old_filter='', new_filter=''))
+    op.execute('''
+        CREATE TRIGGER uploaded_files_blob_refs
+        AFTER INSERT OR DELETE OR UPDATE OF sha256 ON uploaded_files
+        FOR EACH ROW EXECUTE FUNCTION uploaded_files_blob_refs()
+    ''')
+    # Мягко удаленные файлы снова держат свои блобы; блобы, уже удаленные сборщиком, остаются
+    # в file_blobs строкой без файла на диске, а не пропадают из учета
+    op.execute('''
+        INSERT INTO file_blobs (sha256)
+        SELECT DISTINCT sha256 FROM uploaded_files WHERE sha256 IS NOT NULL
+        ON CONFLICT (sha256) DO NOTHING
+    ''')
+    op.execute(RECOUNT.format(filter=''))
+
+
+def downgrade() -> None:
+    op.execute('DROP TRIGGER uploaded_files_blob_refs ON uploaded_files')
+    op.execute(REFS_FUNCTION.format(old_filter='AND COALESCE(OLD.deleted, 0) = 0 ',
+                                    new_filter='AND COALESCE(NEW.deleted, 0) = 0 '))
+    op.execute('''
+        CREATE TRIGGER uploaded_files_blob_refs
+        AFTER INSERT OR DELETE OR UPDATE OF sha256, deleted ON uploaded_files
+        FOR EACH ROW EXECUTE FUNCTION uploaded_files_blob_refs()
+    ''')
+    op.execute(RECOUNT.format(filter='AND COALESCE(f.deleted, 0) = 0'))
@@ -0,0 +1,38 @@
+"""Documents full text search
+
+Revision ID: e7a24c6b9f15
+Revises: b51c0e8a7d63
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7a24c6b9f15'
+down_revision: Union[str, None] = 'b51c0e8a7d63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('english'::regconfig, coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('russian'::regconfig, coalesce(title_native, '')), 'A') || "
+    "setweight(to_tsvector('english'::regconfig, coalesce(remarks, '')), 'C')"
+)
+
+
+def upgrade() -> None:
+    # Английское название и примечания - словарь english, название на родном языке - russian
+    op.add_column('documents', sa.Column('search_vector', postgresql.TSVECTOR(),
+                                         sa.Computed(SEARCH_VECTOR, persisted=True), nullable=True))
+    op.create_index('ix_documents_search_vector', 'documents', ['search_vector'], unique=False,
+                    postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_documents_search_vector', table_name='documents')
+    op.drop_column('documents', 'search_vector')
@@ -0,0 +1,30 @@
+"""Documents number trigram index
+
+Revision ID: f2c8d4a6e931
+Revises: e7a24c6b9f15
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2c8d4a6e931'
+down_revision: Union[str, None] = 'e7a24c6b9f15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Триграммный индекс для поиска по части номера (ILIKE '%...%') и нечеткого поиска (%)
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_documents_number_trgm', 'documents', ['number'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'number': 'gin_trgm_ops'},
+                    postgresql_where=sa.text('deleted = 0'))
+
+
+def downgrade() -> None:
+    op.drop_index('ix_documents_number_trgm', table_name='documents')
@@ -0,0 +1,86 @@
+"""Заполняет file_name, file_size, mime_type и sha256 для строк uploaded_files, загруженных до их появления.
+
+Запуск: python backfill_files.py [--batch-size 500] [--skip-checksum] [--dry-run]
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+from database import connect_direct
+from fileProperties import get_mime_type
+from storage import UPLOAD_CHUNK_SIZE
+
+
+def inspect_file(path, checksum):
+    """Возвращает (size, sha256) файла или None, если файла нет на диске."""
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return None
+    if not checksum:
+        return size, None
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(UPLOAD_CHUNK_SIZE):
+            digest.update(chunk)
+    return size, digest.hexdigest()
+
+
+async def backfill(batch_size, checksum, dry_run):
+    conn = await connect_direct()
+    updated = missing = 0
+    last_id = 0
+    try:
+        while True:
+            rows = await conn.fetch('''
+                SELECT id, path, file_name, sha256
+                FROM uploaded_files
+                WHERE id > $1 AND
+                (file_size IS NULL OR mime_type IS NULL OR file_name IS NULL OR ($3 AND sha256 IS NULL))
+                ORDER BY id
+                LIMIT $2
+            ''', last_id, batch_size, checksum)
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+
+            records = []
+            for row in rows:
+                info = await asyncio.to_thread(inspect_file, row['path'], checksum and row['sha256'] is None)
+                if info is None:
+                    missing += 1
+                    print(f'Missing file for uploaded_files.id={row["id"]}: {row["path"]}')
+                    continue
+                size, sha256 = info
+                file_name = row['file_name'] or os.path.basename(row['path'])
+                mime_type = get_mime_type(os.path.splitext(file_name)[1])
+                records.append((row['id'], file_name, size, mime_type, sha256))
+
+            if records and not dry_run:
+                await conn.executemany('''
+                    UPDATE uploaded_files
+                    SET file_name = $2,
+                        file_size = $3,
+                        mime_type = $4,
+                        sha256 = COALESCE(sha256, $5)
+                    WHERE id = $1
+                ''', records)
+            updated += len(records)
+            print(f'Processed up to id={last_id}: {updated} updated, {missing} missing')
+    finally:
+        await conn.close()
+    return updated, missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill metadata columns of uploaded_files')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--skip-checksum', action='store_true', help='do not compute SHA-256 for legacy files')
+    parser.add_argument('--dry-run', action='store_true', help='inspect files without writing to the database')
+    args = parser.parse_args()
+    updated, missing = asyncio.run(backfill(args.batch_size, not args.skip_checksum, args.dry_run))
+    print(f'Done: {updated} rows updated, {missing} files missing')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Нагрузочный тест /token: пропускная способность входа и влияние bcrypt на задержку остальных запросов.
+
+Сначала измеряется задержка легкого запроса (--probe-path) без нагрузки, затем тот же замер
+повторяется, пока --concurrency клиентов непрерывно вызывают /token.
+Результат печатается в JSON.
+
+Пример:
+    python benchmarks/bench_login.py --base-url http://127.0.0.1:8000 --username bench --password bench
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import httpx
+
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    samples = sorted(samples)
+
+    def pick(p):
+        return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1000, 2)
+
+    return {
+        'count': len(samples),
+        'mean_ms': round(statistics.fmean(samples) * 1000, 2),
+        'p50_ms': pick(0.50),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+        'max_ms': round(samples[-1] * 1000, 2),
+    }
+
+
+async def probe(client, path, stop, interval, samples):
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = await client.get(path)
+        response.raise_for_status()
+        samples.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+
+
+async def login(client, username, password, stop, samples, failures):
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = await client.post('/token', data={'username': username, 'password': password})
+        if response.status_code == 200:
+            samples.append(time.perf_counter() - started)
+        else:
+            failures[response.status_code] = failures.get(response.status_code, 0) + 1
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency + 2)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        baseline = []
+        stop = asyncio.Event()
+        task = asyncio.create_task(probe(client, args.probe_path, stop, args.probe_interval, baseline))
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await task
+
+        under_load = []
+        logins = []
+        failures = {}
+        stop = asyncio.Event()
+        tasks = [asyncio.create_task(probe(client, args.probe_path, stop, args.probe_interval, under_load))]
+        tasks += [asyncio.create_task(login(client, args.username, args.password, stop, logins, failures))
+                  for _ in range(args.concurrency)]
+        started = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        stop.set()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    return {
+        'concurrency': args.concurrency,
+        'duration_s': args.duration,
+        'token': {**percentiles(logins), 'throughput_rps': round(len(logins) / elapsed, 2), 'failures': failures},
+        'probe_baseline': {'path': args.probe_path, **percentiles(baseline)},
+        'probe_under_login_load': {'path': args.probe_path, **percentiles(under_load)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark /token throughput and its impact on other endpoints')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--username', required=True)
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--probe-path', default='/api/languages')
+    parser.add_argument('--probe-interval', type=float, default=0.02)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+"""Генератор синтетических данных для проверки масштабирования (миллионы документов и файлов).
+
+Создает проекты, глубокие деревья папок, документы с неравномерным (по закону Ципфа) распределением
+по папкам, строки uploaded_files и файлы-заглушки блобов на диске. Колонки берутся из моделей
+models.py, строки загружаются через COPY (copy_records_to_table) порциями по --batch-size.
+
+Справочники (дисциплины, типы документов, статусы...) и пользователи должны уже быть в базе
+(например, восстановленной из docste2.sql) - документы ссылаются на их id. Id новых строк
+назначаются генератором (после max(id)), поэтому во время генерации база не должна использоваться.
+
+Запуск (параметры подключения - из DB_URL, как у приложения):
+    python benchmarks/generate_data.py --scale 10 --depth 15 --skew 1.2
+    python benchmarks/generate_data.py --scale 50 --defer-indexes --no-blob-files
+
+При --scale 1: 5 проектов по 100 папок, 100 000 документов, в среднем 1.5 файла на документ, 1000 блобов.
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import os
+import random
+import sys
+import time
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import connect_direct  # noqa: E402
+from fileProperties import get_mime_type  # noqa: E402
+from models import (Project, Folder, Document, UploadedFile, FileBlob, Discipline, DocumentType,  # noqa: E402
+                    RevisionStatus, RevisionStep, RevisionDescription, Language, User)
+from storage import blob_path  # noqa: E402
+
+# Колонки COPY в порядке значений в генерируемых кортежах
+PROJECT_COLUMNS = [Project.id, Project.number, Project.name, Project.name_native]
+FOLDER_COLUMNS = [Folder.id, Folder.name, Folder.parent_id, Folder.project_id, Folder.deleted]
+DOCUMENT_COLUMNS = [
+    Document.id, Document.created, Document.modified, Document.deleted, Document.number, Document.title,
+    Document.title_native, Document.remarks, Document.project_id, Document.discipline_id, Document.type_id,
+    Document.revision_status_id, Document.revision_description_id, Document.revision_step_id,
+    Document.revision_number, Document.language_id, Document.folder_id, Document.user_id,
+]
+UPLOADED_FILE_COLUMNS = [
+    UploadedFile.id, UploadedFile.created, UploadedFile.deleted, UploadedFile.path, UploadedFile.document_id,
+    UploadedFile.sha256, UploadedFile.file_name, UploadedFile.file_size, UploadedFile.mime_type,
+]
+BLOB_COLUMNS = [FileBlob.sha256, FileBlob.size, FileBlob.ref_count]
+
+LOOKUPS = {
+    'discipline': Discipline,
+    'document_type': DocumentType,
+    'revision_status': RevisionStatus,
+    'revision_step': RevisionStep,
+    'revision_description': RevisionDescription,
+    'language': Language,
+    'user': User,
+}
+
+WORDS = ['pipeline', 'layout', 'general', 'arrangement', 'datasheet', 'specification', 'pump', 'station',
+         'compressor', 'foundation', 'electrical', 'cable', 'routing', 'instrument', 'loop', 'diagram', 'piping',
+         'isometric', 'valve', 'schedule', 'civil', 'structural', 'steel', 'tank', 'heat', 'exchanger', 'fire',
+         'protection', 'hvac', 'control', 'system', 'philosophy', 'calculation', 'report', 'drawing', 'list']
+WORDS_NATIVE = ['трубопровод', 'компоновка', 'общий', 'вид', 'опросный', 'лист', 'спецификация', 'насосная',
+                'станция', 'компрессор', 'фундамент', 'электрический', 'кабель', 'трасса', 'прибор', 'контур',
+                'схема', 'изометрия', 'клапан', 'ведомость', 'строительный', 'металлоконструкции', 'резервуар',
+                'теплообменник', 'пожаротушение', 'вентиляция', 'управление', 'система', 'расчет', 'отчет']
+REVISIONS = ['A', 'B', 'C', '0', '1', '2', '3']
+FILE_EXTENSIONS = ['.pdf', '.pdf', '.pdf', '.dwg', '.docx', '.xlsx']
+
+
+def names(columns):
+    return [column.name for column in columns]
+
+
+def table(columns):
+    return columns[0].table.name
+
+
+class Scale:
+    def __init__(self, args):
+        self.projects = max(1, round(5 * args.scale))
+        self.folders_per_project = max(1, round(100 * args.folders_scale))
+        self.documents = max(1, round(100_000 * args.scale))
+        self.blobs = max(1, round(1000 * args.scale))
+
+
+def build_folder_tree(rng, first_id, project_id, count, depth, chain):
+    """Дерево папок проекта глубиной до depth уровней.
+
+    С вероятностью chain новая папка продолжает самую глубокую ветку (длинные цепочки),
+    иначе подвешивается к случайной папке, у которой еще есть запас глубины.
+    """
+    rows = []
+    levels = []
+    deepest = None
+    for index in range(count):
+        folder_id = first_id + index
+        if not rows or depth <= 1 or rng.random() < 0.02:
+            parent, level = None, 0
+        elif deepest is not None and levels[deepest] < depth - 1 and rng.random() < chain:
+            parent, level = first_id + deepest, levels[deepest] + 1
+        else:
+            candidate = rng.randrange(len(rows))
+            while levels[candidate] >= depth - 1:
+                candidate = rng.randrange(len(rows))
+            parent, level = first_id + candidate, levels[candidate] + 1
+        rows.append((folder_id, f'Folder {project_id}.{index + 1} L{level}', parent, project_id, 0))
+        levels.append(level)
+        if deepest is None or level > levels[deepest] or rng.random() < 0.1:
+            deepest = index
+    return rows
+
+
+def zipf_cumulative(rng, count, skew):
+    """Накопленные веса папок: вес папки ранга r пропорционален 1 / r^skew, ранги перемешаны."""
+    ranks = list(range(1, count + 1))
+    rng.shuffle(ranks)
+    return list(itertools.accumulate(1.0 / rank ** skew for rank in ranks))
+
+
+def pick_weighted(rng, cumulative):
+    return bisect_right(cumulative, rng.random() * cumulative[-1])
+
+
+def phrase(rng, words, low, high):
+    return ' '.join(rng.choice(words) for _ in range(rng.randint(low, high))).capitalize()
+
+
+def dummy_blob(seed, index, size):
+    """Содержимое блоба-заглушки: детерминировано по seed и номеру, у каждого блоба свой SHA-256."""
+    header = f'docste synthetic blob {seed}:{index}\n'.encode()
+    content = (header * (size // len(header) + 1))[:size]
+    return content, hashlib.sha256(content).hexdigest()
+
+
+def write_blob(path, content):
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.part'
+    with open(tmp, 'wb') as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+async def next_id(conn, columns):
+    return await conn.fetchval(f'SELECT COALESCE(max(id), 0) + 1 FROM {table(columns)}')
+
+
+async def copy(conn, columns, records):
+    await conn.copy_records_to_table(table(columns), records=records, columns=names(columns))
+
+
+async def reset_sequence(conn, columns):
+    name = table(columns)
+    await conn.execute(f"""
+        SELECT setval(pg_get_serial_sequence('{name}', 'id'), (SELECT COALESCE(max(id), 1) FROM {name}))
+    """)
+
+
+class Progress:
+    def __init__(self, name, total=None):
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.started = time.perf_counter()
+
+    def add(self, count):
+        self.done += count
+        elapsed = time.perf_counter() - self.started
+        done = self.done if self.total is None else f'{self.done}/{self.total}'
+        print(f'{self.name}: {done} ({self.done / max(elapsed, 1e-9):,.0f} rows/s)', flush=True)
+
+
+async def load_lookups(conn):
+    lookups = {}
+    for name, model in LOOKUPS.items():
+        rows = await conn.fetch(f'SELECT id FROM {model.__tablename__} ORDER BY id')
+        if not rows:
+            raise SystemExit(f'Table {model.__tablename__} is empty: restore reference data (docste2.sql) first')
+        lookups[name] = [row['id'] for row in rows]
+    lookups['discipline_code'] = dict(await conn.fetch('SELECT id, COALESCE(code, id::text) FROM disciplines'))
+    lookups['type_code'] = dict(await conn.fetch('SELECT id, COALESCE(code, id::text) FROM document_types'))
+    return lookups
+
+
+async def generate(args):
+    rng = random.Random(args.seed)
+    scale = Scale(args)
+    conn = await connect_direct()
+    try:
+        lookups = await load_lookups(conn)
+        started = time.perf_counter()
+
+        # Проекты и папки - небольшие объемы, одной порцией
+        project_id = await next_id(conn, PROJECT_COLUMNS)
+        projects = [(project_id + i, f'SYN-{project_id + i:05d}', f'Synthetic project {project_id + i}',
+                     f'Синтетический проект {project_id + i}') for i in range(scale.projects)]
+        await copy(conn, PROJECT_COLUMNS, projects)
+
+        folder_id = await next_id(conn, FOLDER_COLUMNS)
+        folders = []
+        for project in projects:
+            folders += build_folder_tree(rng, folder_id + len(folders), project[0], scale.folders_per_project,
+                                         args.depth, args.chain)
+        await copy(conn, FOLDER_COLUMNS, folders)
+        print(f'projects: {len(projects)}, folders: {len(folders)}', flush=True)
+
+        # Блобы: содержимое детерминировано, строки file_blobs получают итоговое число ссылок
+        first_document = await next_id(conn, DOCUMENT_COLUMNS)
+        blob_seed = f'{args.seed}:{first_document}'
+        blobs = [dummy_blob(blob_seed, index, args.blob_size)[1] for index in range(scale.blobs)]
+        blob_refs = [0] * len(blobs)
+
+        # Счетчик ссылок file_blobs ведется построчным триггером - на время загрузки он отключается,
+        # а ref_count записывается сразу итоговым
+        await conn.execute('ALTER TABLE uploaded_files DISABLE TRIGGER uploaded_files_blob_refs')
+        dropped = await drop_document_indexes(conn) if args.defer_indexes else []
+        try:
+            await load_documents(conn, rng, args, scale, lookups, folders, first_document, blobs, blob_refs)
+        finally:
+            await conn.execute('ALTER TABLE uploaded_files ENABLE TRIGGER uploaded_files_blob_refs')
+            if dropped:
+                await recreate_indexes(conn, dropped)
+
+        await conn.execute('CREATE TEMPORARY TABLE synthetic_blobs (LIKE file_blobs INCLUDING DEFAULTS)')
+        await conn.copy_records_to_table('synthetic_blobs', records=list(zip(blobs, [args.blob_size] * len(blobs),
+                                                                             blob_refs)),
+                                         columns=names(BLOB_COLUMNS))
+        await conn.execute('''
+            INSERT INTO file_blobs (sha256, size, ref_count)
+            SELECT sha256, size, ref_count FROM synthetic_blobs
+            ON CONFLICT (sha256) DO UPDATE SET ref_count = file_blobs.ref_count + EXCLUDED.ref_count
+        ''')
+        if not args.no_blob_files:
+            for index in range(len(blobs)):
+                content, sha256 = dummy_blob(blob_seed, index, args.blob_size)
+                await asyncio.to_thread(write_blob, blob_path(sha256), content)
+            print(f'blob files: {len(blobs)} written', flush=True)
+
+        for columns in (PROJECT_COLUMNS, FOLDER_COLUMNS, DOCUMENT_COLUMNS, UPLOADED_FILE_COLUMNS):
+            await reset_sequence(conn, columns)
+            await conn.execute(f'ANALYZE {table(columns)}')
+        print(f'Done in {time.perf_counter() - started:.1f} s', flush=True)
+    finally:
+        await conn.close()
+
+
+async def load_documents(conn, rng, args, scale, lookups, folders, first_document, blobs, blob_refs):
+    cumulative = zipf_cumulative(rng, len(folders), args.skew)
+    project_numbers = {}
+    now = datetime.now(timezone.utc)
+    mime_types = {extension: get_mime_type(extension) for extension in FILE_EXTENSIONS}
+    file_id = await next_id(conn, UPLOADED_FILE_COLUMNS)
+    documents_progress = Progress('documents', scale.documents)
+    files_progress = Progress('uploaded_files')
+
+    for batch_start in range(0, scale.documents, args.batch_size):
+        documents = []
+        files = []
+        for document_id in range(first_document + batch_start,
+                                 first_document + min(batch_start + args.batch_size, scale.documents)):
+            folder = folders[pick_weighted(rng, cumulative)]
+            project_id = folder[3]
+            project_numbers[project_id] = project_numbers.get(project_id, 0) + 1
+            discipline_id = rng.choice(lookups['discipline'])
+            type_id = rng.choice(lookups['document_type'])
+            number = (f'SYN{project_id}-{lookups["discipline_code"][discipline_id]}-{lookups["type_code"][type_id]}-'
+                      f'{project_numbers[project_id]:06d}')
+            created = now - timedelta(seconds=rng.randrange(3 * 365 * 24 * 3600))
+            deleted = 1 if rng.random() < args.deleted_share else 0
+            documents.append((
+                document_id,
+                created,
+                created + timedelta(seconds=rng.randrange(90 * 24 * 3600)),
+                deleted,
+                number,
+                phrase(rng, WORDS, 3, 8),
+                phrase(rng, WORDS_NATIVE, 3, 8) if rng.random() < 0.7 else None,
+                phrase(rng, WORDS, 5, 20) if rng.random() < 0.2 else None,
+                project_id,
+                discipline_id,
+                type_id,
+                rng.choice(lookups['revision_status']),
+                rng.choice(lookups['revision_description']),
+                rng.choice(lookups['revision_step']),
+                rng.choice(REVISIONS),
+                rng.choice(lookups['language']),
+                folder[0],
+                rng.choice(lookups['user']),
+            ))
+            for n in range(int(rng.expovariate(1 / args.files_per_document)) if args.files_per_document else 0):
+                blob = rng.randrange(len(blobs))
+                file_deleted = deleted or int(rng.random() < args.deleted_share)
+                # Мягко удаленные файлы тоже держат блоб (см. триггер uploaded_files_blob_refs)
+                blob_refs[blob] += 1
+                extension = rng.choice(FILE_EXTENSIONS)
+                files.append((file_id, created, file_deleted, blob_path(blobs[blob]), document_id, blobs[blob],
+                              f'{number}_{n + 1}{extension}', args.blob_size, mime_types[extension]))
+                file_id += 1
+        # Порция - одна транзакция: триггер версий папок выполняется один раз на COPY
+        async with conn.transaction():
+            await copy(conn, DOCUMENT_COLUMNS, documents)
+            if files:
+                await copy(conn, UPLOADED_FILE_COLUMNS, files)
+        documents_progress.add(len(documents))
+        files_progress.add(len(files))
+
+
+async def drop_document_indexes(conn):
+    """Удаляет вторичные индексы documents, существующие в базе; возвращает их определения для пересоздания.
+
+    Определения берутся из каталога (pg_get_indexdef), а не из модели: в модели объявлены индексы,
+    которых нет в схеме после миграций. Индексы ограничений (первичный ключ, unique) не трогаются.
+    """
+    indexes = await conn.fetch('''
+        SELECT i.indexrelid::regclass::text name, pg_get_indexdef(i.indexrelid) definition
+        FROM pg_index i
+        WHERE i.indrelid = $1::regclass AND
+        NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)
+    ''', table(DOCUMENT_COLUMNS))
+    for index in indexes:
+        await conn.execute(f'DROP INDEX {index["name"]}')
+    print(f'dropped {len(indexes)} documents indexes', flush=True)
+    return indexes
+
+
+async def recreate_indexes(conn, indexes):
+    for index in indexes:
+        started = time.perf_counter()
+        await conn.execute(index['definition'])
+        print(f'index {index["name"]}: {time.perf_counter() - started:.1f} s', flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic projects, folders, documents and files')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier for projects, documents and blobs')
+    parser.add_argument('--folders-scale', type=float, default=1.0, help='multiplier for folders per project')
+    parser.add_argument('--depth', type=int, default=12, help='maximum folder tree depth')
+    parser.add_argument('--chain', type=float, default=0.3, help='probability to extend the deepest branch')
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of documents per folder')
+    parser.add_argument('--files-per-document', type=float, default=1.5, help='mean uploaded files per document')
+    parser.add_argument('--deleted-share', type=float, default=0.01, help='share of soft-deleted rows')
+    parser.add_argument('--blob-size', type=int, default=16 * 1024, help='size of dummy blob files in bytes')
+    parser.add_argument('--no-blob-files', action='store_true', help='do not write blob files to disk')
+    parser.add_argument('--defer-indexes', action='store_true',
+                        help='drop documents indexes during the load and rebuild them afterwards')
+    parser.add_argument('--batch-size', type=int, default=50_000, help='documents per COPY batch')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(generate(args))
+
+
+if __name__ == '__main__':
+    main()
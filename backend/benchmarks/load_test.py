@@ -0,0 +1,351 @@
+"""Нагрузочный тест API на данных из docste2.sql.
+
+1. Восстанавливает docste2.sql во временный PostgreSQL (initdb во временном каталоге) или, если задан
+   --server-dsn, во временную базу на существующем сервере, и применяет миграции Alembic.
+2. Запускает uvicorn с этой базой и временным каталогом загрузок, регистрирует пользователя bench.
+3. По очереди нагружает каждую точку (--concurrency клиентов в течение --duration секунд):
+   /api/data, /api/folders/{id}, /token, /api/getfiles, /api/addfiles и справочники.
+4. Пишет p50/p95/p99 и пропускную способность по каждой точке в JSON (benchmarks/results/).
+
+Параметры запросов выбираются генератором случайных чисел с --seed, поэтому прогоны сравнимы.
+Сравнение двух прогонов: python benchmarks/load_test.py --compare before.json after.json
+
+Пример:
+    python benchmarks/load_test.py --concurrency 16 --duration 15 --label keyset-pagination
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from urllib.parse import quote, unquote, urlparse
+import asyncpg
+import httpx
+from bench_login import percentiles
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_DUMP = os.path.join(os.path.dirname(BACKEND_DIR), 'docste2.sql')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+BENCH_USERNAME = 'bench'
+BENCH_PASSWORD = 'bench-password'
+# Роль Viewer из docste2.sql: регистрации нужна роль, прав администратора нагрузке не нужно
+BENCH_ROLE_ID = 3
+
+LOOKUP_PATHS = [
+    '/api/disciplines',
+    '/api/document_types',
+    '/api/revision_statuses',
+    '/api/revision_steps',
+    '/api/revision_descriptions',
+    '/api/languages',
+    '/api/projects',
+]
+
+ALEMBIC_UPGRADE = '''
+import sys
+from alembic import command
+from alembic.config import Config
+config = Config('alembic.ini')
+config.set_main_option('sqlalchemy.url', sys.argv[1])
+command.upgrade(config, 'head')
+'''
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def run(command, **kwargs):
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, **kwargs)
+
+
+def pg_binary(name, pg_bin):
+    path = os.path.join(pg_bin, name) if pg_bin else shutil.which(name)
+    if not path or not os.path.exists(path):
+        raise SystemExit(f'{name} not found; pass --pg-bin or --server-dsn')
+    return path
+
+
+@asynccontextmanager
+async def temporary_cluster(pg_bin, workdir):
+    """Временный кластер PostgreSQL с доверительной аутентификацией; удаляется после теста."""
+    data_dir = os.path.join(workdir, 'pgdata')
+    port = free_port()
+    run([pg_binary('initdb', pg_bin), '-D', data_dir, '-U', 'postgres', '--auth=trust', '-E', 'UTF8'])
+    run([pg_binary('pg_ctl', pg_bin), '-D', data_dir, '-w', '-l', os.path.join(workdir, 'postgres.log'),
+         '-o', f'-p {port} -k {workdir} -c listen_addresses=127.0.0.1 -c fsync=off', 'start'])
+    try:
+        yield {'host': '127.0.0.1', 'port': port, 'user': 'postgres', 'password': 'postgres'}
+    finally:
+        run([pg_binary('pg_ctl', pg_bin), '-D', data_dir, '-w', '-m', 'fast', 'stop'])
+
+
+@asynccontextmanager
+async def temporary_database(server, name):
+    conn = await asyncpg.connect(**server, database='postgres')
+    try:
+        await conn.execute(f'CREATE DATABASE {name}')
+    finally:
+        await conn.close()
+    try:
+        yield {**server, 'database': name}
+    finally:
+        conn = await asyncpg.connect(**server, database='postgres')
+        try:
+            await conn.execute(f'DROP DATABASE IF EXISTS {name} WITH (FORCE)')
+        finally:
+            await conn.close()
+
+
+def parse_server(value):
+    url = urlparse(value)
+    return {'host': url.hostname or '127.0.0.1', 'port': url.port or 5432, 'user': unquote(url.username or 'postgres'),
+            'password': unquote(url.password or '')}
+
+
+def dsn(db):
+    return (f'postgresql://{quote(db["user"], safe="")}:{quote(db["password"], safe="")}'
+            f'@{db["host"]}:{db["port"]}/{db["database"]}')
+
+
+def restore(db, dump, pg_bin):
+    env = {**os.environ, 'PGPASSWORD': db['password']}
+    run([pg_binary('psql', pg_bin), '-q', '-v', 'ON_ERROR_STOP=1', '-d', dsn(db), '-f', dump], env=env)
+    run([sys.executable, '-c', ALEMBIC_UPGRADE, dsn(db)], cwd=BACKEND_DIR, env={**os.environ, 'DB_URL': dsn(db)})
+
+
+@asynccontextmanager
+async def api_server(db, workdir, workers):
+    port = free_port()
+    env = {
+        **os.environ,
+        'DB_URL': dsn(db),
+        'UPLOAD_DIR': os.path.join(workdir, 'uploads'),
+        'SLOW_QUERY_PLAN_FILE': os.path.join(workdir, 'slow_query_plans.jsonl'),
+    }
+    log = open(os.path.join(workdir, 'uvicorn.log'), 'wb')
+    process = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1',
+                                '--port', str(port), '--workers', str(workers), '--no-access-log'],
+                               cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            for _ in range(120):
+                if process.poll() is not None:
+                    raise SystemExit(f'uvicorn exited, see {log.name}')
+                try:
+                    if (await client.get('/api/languages')).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.5)
+            else:
+                raise SystemExit(f'uvicorn did not start, see {log.name}')
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        log.close()
+
+
+async def load_targets(db):
+    """Идентификаторы, по которым распределяются запросы: крупные папки, проекты, документы."""
+    conn = await asyncpg.connect(**db)
+    try:
+        folders = await conn.fetch('''
+            SELECT folder_id id, count(*) documents
+            FROM documents
+            WHERE deleted = 0 AND folder_id IS NOT NULL
+            GROUP BY folder_id
+            ORDER BY documents DESC
+            LIMIT 20
+        ''')
+        projects = await conn.fetch('SELECT DISTINCT project_id id FROM folders WHERE deleted = 0')
+        documents = await conn.fetch('SELECT id FROM documents WHERE deleted = 0 ORDER BY id')
+        with_files = await conn.fetch('''
+            SELECT DISTINCT document_id id FROM uploaded_files WHERE deleted = 0 AND document_id IS NOT NULL
+        ''')
+        total = await conn.fetchval('SELECT count(*) FROM documents')
+    finally:
+        await conn.close()
+    return {
+        'folders': [row['id'] for row in folders],
+        'projects': [row['id'] for row in projects],
+        'documents': [row['id'] for row in documents],
+        'documents_with_files': [row['id'] for row in with_files] or [row['id'] for row in documents],
+        'documents_total': total,
+    }
+
+
+def scenarios(targets, upload_size):
+    """Точки нагрузки: имя -> функция (client, rng) -> корутина запроса."""
+    def get(path):
+        return lambda client, rng: client.get(path)
+
+    def upload(client, rng):
+        content = rng.randbytes(upload_size)
+        return client.post('/api/addfiles', params={'document_id': rng.choice(targets['documents'])},
+                           files={'files': (f'bench-{rng.getrandbits(32):08x}.bin', content,
+                                            'application/octet-stream')})
+
+    result = {
+        'data': lambda client, rng: client.get('/api/data', params={'folder_id': rng.choice(targets['folders'])}),
+        'folders': lambda client, rng: client.get(f'/api/folders/{rng.choice(targets["projects"])}'),
+        'token': lambda client, rng: client.post('/token', data={'username': BENCH_USERNAME,
+                                                                 'password': BENCH_PASSWORD}),
+        'getfiles': lambda client, rng: client.get(f'/api/getfiles/{rng.choice(targets["documents_with_files"])}'),
+        'addfiles': upload,
+    }
+    for path in LOOKUP_PATHS:
+        result[path.rsplit('/', 1)[1]] = get(path)
+    return result
+
+
+async def worker(client, request, rng, deadline, samples, failures):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            response = await request(client, rng)
+            status = response.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        if isinstance(status, int) and status < 400:
+            samples.append(time.perf_counter() - started)
+        else:
+            failures[str(status)] = failures.get(str(status), 0) + 1
+
+
+async def drive(base_url, token, request, args):
+    limits = httpx.Limits(max_connections=args.concurrency)
+    headers = {'Authorization': f'Bearer {token}'}
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, headers=headers, timeout=60) as client:
+        # Прогрев: кэши и подготовленные запросы не должны попадать в замер
+        warmup = time.perf_counter() + args.warmup
+        await asyncio.gather(*(worker(client, request, random.Random(args.seed + i), warmup, [], {})
+                               for i in range(args.concurrency)))
+        samples = []
+        failures = {}
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(worker(client, request, random.Random(args.seed + i), deadline, samples, failures)
+                               for i in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+    return {**percentiles(samples), 'throughput_rps': round(len(samples) / elapsed, 2), 'failures': failures}
+
+
+async def authenticate(base_url):
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        response = await client.post('/register', json={'username': BENCH_USERNAME, 'password': BENCH_PASSWORD,
+                                                        'role_id': BENCH_ROLE_ID})
+        if response.status_code not in (200, 400):
+            response.raise_for_status()
+        response = await client.post('/token', data={'username': BENCH_USERNAME, 'password': BENCH_PASSWORD})
+        response.raise_for_status()
+        return response.json()['access_token']
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def benchmark(args, db, workdir):
+    restore(db, args.dump, args.pg_bin)
+    targets = await load_targets(db)
+    available = scenarios(targets, args.upload_size)
+    selected = args.endpoints or list(available)
+    async with api_server(db, workdir, args.workers) as base_url:
+        token = await authenticate(base_url)
+        endpoints = {}
+        for name in selected:
+            print(f'{name}...', file=sys.stderr)
+            endpoints[name] = await drive(base_url, token, available[name], args)
+    return {
+        'label': args.label,
+        'revision': git_revision(),
+        'started': datetime.now(timezone.utc).isoformat(),
+        'concurrency': args.concurrency,
+        'duration_s': args.duration,
+        'workers': args.workers,
+        'seed': args.seed,
+        'documents': targets['documents_total'],
+        'endpoints': endpoints,
+    }
+
+
+async def run_benchmark(args):
+    workdir = tempfile.mkdtemp(prefix='docste-bench-')
+    name = f'docste_bench_{os.getpid()}'
+    try:
+        if args.server_dsn:
+            async with temporary_database(parse_server(args.server_dsn), name) as db:
+                return await benchmark(args, db, workdir)
+        async with temporary_cluster(args.pg_bin, workdir) as server:
+            async with temporary_database(server, name) as db:
+                return await benchmark(args, db, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    result = {}
+    for name, stats in after['endpoints'].items():
+        old = before['endpoints'].get(name)
+        if not old:
+            continue
+        result[name] = {key: {'before': old.get(key), 'after': stats.get(key),
+                              'change_pct': round((stats[key] - old[key]) / old[key] * 100, 1) if old.get(key) else None}
+                        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps') if key in stats}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the API on a throwaway copy of docste2.sql')
+    parser.add_argument('--dump', default=DEFAULT_DUMP)
+    parser.add_argument('--pg-bin', help='directory with initdb, pg_ctl and psql')
+    parser.add_argument('--server-dsn', help='use this PostgreSQL server instead of a temporary cluster')
+    parser.add_argument('--endpoints', nargs='+', help='subset of endpoints to run')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=15.0)
+    parser.add_argument('--warmup', type=float, default=2.0)
+    parser.add_argument('--workers', type=int, default=1, help='uvicorn worker processes')
+    parser.add_argument('--upload-size', type=int, default=64 * 1024)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--label', default='run')
+    parser.add_argument('--output', help='result file (default: benchmarks/results/<label>-<time>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        print(json.dumps(compare(*args.compare), indent=2))
+        return
+    result = asyncio.run(run_benchmark(args))
+    output = args.output or os.path.join(RESULTS_DIR, f'{args.label}-{datetime.now():%Y%m%d-%H%M%S}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(json.dumps(result, indent=2))
+    print(f'Saved to {output}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
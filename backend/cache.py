@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from database import connect_direct
+
+REFERENCE_CACHE_TTL = float(os.getenv("REFERENCE_CACHE_TTL", "300"))
+REFERENCE_CACHE_MAXSIZE = int(os.getenv("REFERENCE_CACHE_MAXSIZE", "256"))
+FOLDER_CACHE_TTL = float(os.getenv("FOLDER_CACHE_TTL", "3600"))
+FOLDER_CACHE_MAXSIZE = int(os.getenv("FOLDER_CACHE_MAXSIZE", "1024"))
+PRINCIPAL_CACHE_MAXSIZE = int(os.getenv("PRINCIPAL_CACHE_MAXSIZE", "4096"))
+
+logger = logging.getLogger(__name__)
+
+# Канал LISTEN/NOTIFY, через который процессы (API, Flask-Admin) сообщают об изменении справочников
+REFERENCE_CHANNEL = 'reference_data'
+
+
+class TTLCache:
+    """Ограниченный по размеру LRU-кэш с временем жизни записей.
+
+    Ключи - кортежи, первый элемент которых - имя группы (для инвалидации целой группы).
+    Поколения ведутся отдельно для ключей и групп: сброс одного ключа не мешает кэшировать
+    значения, которые в это время загружаются по другим ключам.
+    """
+
+    def __init__(self, maxsize=256, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._loading = {}
+        self._epoch = 0
+        self._key_generations = {}
+        self._group_generations = {}
+
+    def generation(self, key):
+        """Поколение ключа: меняется при сбросе самого ключа, его группы или всего кэша."""
+        return self._epoch, self._group_generations.get(key[0], 0), self._key_generations.get(key, 0)
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None, generation=None):
+        # Значение, загруженное до инвалидации, не должно попасть в кэш
+        if generation is not None and generation != self.generation(key):
+            return
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def get_or_load(self, key, loader):
+        """Возвращает значение из кэша, а при промахе - результат loader().
+
+        Одновременные промахи по одному ключу ждут одну и ту же загрузку.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        task = self._loading.get(key)
+        if task is None:
+            generation = self.generation(key)
+            task = asyncio.create_task(loader())
+            self._loading[key] = task
+
+            def done(task):
+                if self._loading.get(key) is task:
+                    del self._loading[key]
+                if not task.cancelled() and task.exception() is None:
+                    self.set(key, task.result(), generation=generation)
+
+            task.add_done_callback(done)
+        return await asyncio.shield(task)
+
+    def discard(self, key):
+        self._key_generations[key] = self._key_generations.get(key, 0) + 1
+        self._data.pop(key, None)
+        self._loading.pop(key, None)
+
+    def invalidate(self, name):
+        self._group_generations[name] = self._group_generations.get(name, 0) + 1
+        for key in [key for key in self._data if key[0] == name]:
+            del self._data[key]
+        for key in [key for key in self._loading if key[0] == name]:
+            del self._loading[key]
+
+    def clear(self):
+        self._epoch += 1
+        self._key_generations.clear()
+        self._group_generations.clear()
+        self._data.clear()
+        self._loading.clear()
+
+    def stats(self):
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+reference_cache = TTLCache(maxsize=REFERENCE_CACHE_MAXSIZE, ttl=REFERENCE_CACHE_TTL)
+
+# Сериализованные деревья папок по проектам: ключ ('folders', project_id)
+folder_cache = TTLCache(maxsize=FOLDER_CACHE_MAXSIZE, ttl=FOLDER_CACHE_TTL)
+
+# Пользователи по токенам: ключ (user_id, token), запись живет не дольше токена
+principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_MAXSIZE)
+
+# Какие группы кэша зависят от таблицы
+REFERENCE_TABLES = {
+    'disciplines': ('disciplines', 'lookup_names'),
+    'document_types': ('document_types', 'lookup_names'),
+    'revision_statuses': ('revision_statuses', 'lookup_names'),
+    'revision_steps': ('revision_steps', 'lookup_names'),
+    'revision_descriptions': ('revision_descriptions', 'lookup_names'),
+    'languages': ('languages', 'lookup_names'),
+    'projects': ('projects', 'user_projects', 'lookup_names'),
+    'user_roles': ('roles', 'users'),
+    'users': ('users', 'user_projects'),
+    'user_project_access': ('user_projects',),
+}
+
+
+def invalidate_table(table, key=None):
+    if table == 'folders':
+        if key is None:
+            folder_cache.clear()
+        else:
+            folder_cache.discard(('folders', int(key)))
+        return
+    if table == 'principals':
+        if key is None:
+            principal_cache.clear()
+        else:
+            principal_cache.invalidate(int(key))
+        return
+    if table in ('users', 'user_project_access'):
+        # Роль, активность и доступ к проектам входят в закэшированного пользователя. Без id
+        # (например, из Flask-Admin) неизвестно, чей доступ изменился, поэтому сбрасываются все
+        if key is None:
+            principal_cache.clear()
+        else:
+            principal_cache.invalidate(int(key))
+    for name in REFERENCE_TABLES.get(table, ()):
+        reference_cache.invalidate(name)
+
+
+async def notify_change(conn, table, key=None):
+    """Сбрасывает кэш локально и оповещает остальные процессы об изменении таблицы.
+
+    key уточняет, какая часть данных изменилась (например, project_id для дерева папок).
+    """
+    invalidate_table(table, key)
+    payload = table if key is None else f'{table}:{key}'
+    await conn.execute("SELECT pg_notify($1, $2)", REFERENCE_CHANNEL, payload)
+
+
+def _on_notify(connection, pid, channel, payload):
+    table, _, key = payload.partition(':')
+    invalidate_table(table, key or None)
+
+
+# Проверка соединения LISTEN и задержки переподключения (секунды)
+LISTENER_PING_INTERVAL = float(os.getenv("LISTENER_PING_INTERVAL", "30"))
+LISTENER_RECONNECT_MIN = 1.0
+LISTENER_RECONNECT_MAX = 60.0
+
+_listener = None
+_listener_task = None
+
+
+def clear_all():
+    reference_cache.clear()
+    folder_cache.clear()
+    principal_cache.clear()
+
+
+async def _connect_listener():
+    conn = await connect_direct()
+    await conn.add_listener(REFERENCE_CHANNEL, _on_notify)
+    return conn
+
+
+async def _wait_closed(conn):
+    """Ждет разрыва соединения: по сигналу asyncpg или по неудачной проверке SELECT 1."""
+    closed = asyncio.Event()
+    conn.add_termination_listener(lambda connection: closed.set())
+    while not closed.is_set():
+        try:
+            await asyncio.wait_for(closed.wait(), LISTENER_PING_INTERVAL)
+        except TimeoutError:
+            try:
+                await conn.execute('SELECT 1', timeout=LISTENER_PING_INTERVAL)
+            except Exception:
+                return
+
+
+async def _keep_listening():
+    """Переподключает LISTEN после разрыва соединения (перезапуск БД, таймаут простоя, переключение).
+
+    Пока соединения не было, оповещения могли потеряться, поэтому после переподключения
+    все кэши сбрасываются.
+    """
+    global _listener
+    delay = LISTENER_RECONNECT_MIN
+    while True:
+        await _wait_closed(_listener)
+        logger.warning('Cache invalidation listener disconnected, reconnecting')
+        _listener.terminate()
+        _listener = None
+        while _listener is None:
+            try:
+                _listener = await _connect_listener()
+            except Exception as e:
+                logger.warning('Cache invalidation listener reconnect failed: %s; retrying in %.0f s', e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, LISTENER_RECONNECT_MAX)
+        delay = LISTENER_RECONNECT_MIN
+        clear_all()
+        logger.info('Cache invalidation listener reconnected, caches cleared')
+
+
+async def start_listener():
+    global _listener, _listener_task
+    _listener = await _connect_listener()
+    _listener_task = asyncio.create_task(_keep_listening())
+
+
+async def stop_listener():
+    global _listener, _listener_task
+    if _listener_task is not None:
+        _listener_task.cancel()
+        _listener_task = None
+    if _listener is not None:
+        await _listener.close()
+        _listener = None
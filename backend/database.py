@@ -1,10 +1,15 @@
 import os
+import re
+import time
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+import asyncpg
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from databases import Database
 from sqlalchemy import MetaData
+from metrics import db_acquire_duration, db_query_duration, db_query_errors
+from slow_queries import SLOW_QUERY_THRESHOLD, record_slow_query
 
 load_dotenv()
 
@@ -13,5 +18,128 @@ DATABASE_URL = os.getenv("DB_URL")
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
-database = Database(DATABASE_URL)
 metadata = MetaData()
+
+# asyncpg принимает только postgresql://, без указания драйвера SQLAlchemy (postgresql+psycopg2://)
+ASYNCPG_DSN = re.sub(r'^postgres(ql)?\+\w+://', 'postgresql://', DATABASE_URL)
+
+# Параметры пула соединений asyncpg (переопределяются через переменные окружения)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "10"))
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", "300"))
+
+pool: asyncpg.Pool | None = None
+
+pool_stats = {
+    "acquired_total": 0,
+    "acquire_timeouts": 0,
+    "in_use": 0,
+    "wait_seconds_total": 0.0,
+    "wait_seconds_max": 0.0,
+}
+
+
+async def init_pool():
+    global pool
+    pool = await asyncpg.create_pool(
+        ASYNCPG_DSN,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+    )
+    return pool
+
+
+# Отдельное соединение вне пула (для LISTEN и служебных задач)
+async def connect_direct():
+    return await asyncpg.connect(ASYNCPG_DSN)
+
+
+async def close_pool():
+    global pool
+    if pool is not None:
+        await pool.close()
+        pool = None
+
+
+@asynccontextmanager
+async def acquire():
+    """Берет соединение из общего пула и гарантированно возвращает его обратно."""
+    if pool is None:
+        raise RuntimeError("Database pool is not initialized")
+    started = time.perf_counter()
+    try:
+        conn = await pool.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT)
+    except TimeoutError:
+        pool_stats["acquire_timeouts"] += 1
+        raise
+    waited = time.perf_counter() - started
+    db_acquire_duration.observe(waited)
+    pool_stats["acquired_total"] += 1
+    pool_stats["wait_seconds_total"] += waited
+    pool_stats["wait_seconds_max"] = max(pool_stats["wait_seconds_max"], waited)
+    pool_stats["in_use"] += 1
+    try:
+        yield conn
+    finally:
+        pool_stats["in_use"] -= 1
+        await pool.release(conn)
+
+
+def get_pool_stats():
+    stats = dict(pool_stats)
+    acquired = stats["acquired_total"]
+    stats["wait_seconds_avg"] = stats["wait_seconds_total"] / acquired if acquired else 0.0
+    if pool is not None:
+        stats["size"] = pool.get_size()
+        stats["idle"] = pool.get_idle_size()
+        stats["min_size"] = pool.get_min_size()
+        stats["max_size"] = pool.get_max_size()
+    return stats
+
+
+@asynccontextmanager
+async def timed(name, query=None, args=()):
+    """Замер операции с постоянным именем, которая не сводится к одному fetch/execute (COPY, чтение курсором).
+
+    Если передан query, долгая операция попадает и в журнал медленных запросов.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        db_query_errors.inc(name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        db_query_duration.observe(elapsed, name)
+        if query is not None and elapsed >= SLOW_QUERY_THRESHOLD:
+            record_slow_query(name, query, args, elapsed)
+
+
+async def _timed(name, method, query, args):
+    async with timed(name, query, args):
+        return await method(query, *args)
+
+
+# Запросы с постоянным именем (documents_by_folder, folder_tree, ...): их длительность попадает в /metrics
+async def fetch(conn, name, query, *args):
+    return await _timed(name, conn.fetch, query, args)
+
+
+async def fetchrow(conn, name, query, *args):
+    return await _timed(name, conn.fetchrow, query, args)
+
+
+async def fetchval(conn, name, query, *args):
+    return await _timed(name, conn.fetchval, query, args)
+
+
+async def execute(conn, name, query, *args):
+    return await _timed(name, conn.execute, query, args)
+
+
+async def copy_records(conn, name, table, records, columns):
+    async with timed(name, f'COPY {table} ({", ".join(columns)}) FROM STDIN', (records,)):
+        return await conn.copy_records_to_table(table, records=records, columns=columns)
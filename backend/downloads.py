@@ -0,0 +1,113 @@
+import asyncio
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import HTTPException
+from starlette.responses import FileResponse, Response, StreamingResponse
+from metrics import download_bytes
+
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(256 * 1024)))
+
+# Блобы адресуются по содержимому и не меняются - их можно кэшировать навсегда
+IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+# Файлы старого формата (./uploads/<имя>) могут быть перезаписаны - только с перепроверкой
+REVALIDATE_CACHE_CONTROL = 'private, no-cache'
+
+
+def etag_matches(header, etag):
+    # Для If-None-Match используется слабое сравнение (RFC 9110, 13.1.2)
+    if header.strip() == '*':
+        return True
+    opaque = etag.removeprefix('W/')
+    return any(tag.strip().removeprefix('W/') == opaque for tag in header.split(','))
+
+
+def _not_modified(request, etag, mtime):
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _parse_range(header, size):
+    """Разбирает заголовок Range с одним диапазоном. Возвращает (start, end) включительно или None.
+
+    Несколько диапазонов не поддерживаются - в этом случае отдается весь файл (это допустимо по RFC).
+    """
+    unit, _, ranges = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in ranges:
+        return None
+    start, _, end = ranges.strip().partition('-')
+    try:
+        if start:
+            start = int(start)
+            end = min(int(end), size - 1) if end else size - 1
+        else:
+            # bytes=-N - последние N байт
+            start = max(size - int(end), 0)
+            end = size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, detail='Requested range not satisfiable',
+                            headers={'Content-Range': f'bytes */{size}'})
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(length)
+
+
+async def _iter_range(path, start, end):
+    position = start
+    while position <= end:
+        length = min(DOWNLOAD_CHUNK_SIZE, end - position + 1)
+        chunk = await asyncio.to_thread(_read_range, path, position, length)
+        if not chunk:
+            break
+        position += len(chunk)
+        yield chunk
+
+
+async def send_file(request, path, media_type, etag=None, immutable=False):
+    """Отдает файл с поддержкой ETag/If-None-Match, If-Modified-Since и запросов Range.
+
+    Если etag не передан (файлы без сохраненного хэша), используется слабый ETag из mtime и размера.
+    """
+    try:
+        stat = await asyncio.to_thread(os.stat, path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail='Файл не найден')
+    if etag is None:
+        etag = f'W/"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': formatdate(stat.st_mtime, usegmt=True),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+    }
+    if _not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get('range')
+    if_range = request.headers.get('if-range')
+    # If-Range: диапазон отдается, только если файл не изменился (сильное сравнение ETag)
+    if range_header and (if_range is None or if_range.strip() == etag and not etag.startswith('W/')):
+        byte_range = _parse_range(range_header, stat.st_size)
+        if byte_range is not None:
+            start, end = byte_range
+            headers['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+            headers['Content-Length'] = str(end - start + 1)
+            download_bytes.inc(amount=end - start + 1)
+            return StreamingResponse(_iter_range(path, start, end), status_code=206, media_type=media_type,
+                                     headers=headers)
+
+    download_bytes.inc(amount=stat.st_size)
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat)
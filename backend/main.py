@@ -1,21 +1,54 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Query, Depends, status
+from fastapi import FastAPI, HTTPException, UploadFile, File, Query, Depends, Request, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
-from passlib.context import CryptContext
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-import asyncpg
-from async_lru import alru_cache
+from fastapi.responses import JSONResponse, Response, StreamingResponse, PlainTextResponse
+from contextlib import asynccontextmanager
 from typing import List
 from pydantic import BaseModel
 import os
+import time
+import asyncio
+from urllib.parse import quote
 from dotenv import load_dotenv
 from fileProperties import get_mime_type, generate_uid
-from database import database
-from models import users
+from database import init_pool, close_pool, acquire, get_pool_stats, fetch, fetchrow, fetchval, execute, \
+    copy_records
+from cache import reference_cache, folder_cache, principal_cache, notify_change, start_listener, stop_listener
+from serialization import dumps, ORJSONResponse
+from passwords import hash_password, verify_password, needs_rehash, shutdown as shutdown_password_pool
+from storage import MAX_UPLOAD_FILE_SIZE, MAX_UPLOAD_REQUEST_SIZE, store_blob, garbage_collector, UploadSizeLimitMiddleware
+from downloads import send_file, etag_matches
+from response_cache import register_cache, encoded_response
+from metrics import MetricsRoute, register_collector, render as render_metrics
+from slow_queries import get_slow_queries
+from register_io import DOCUMENT_COPY_COLUMNS, read_import_file, load_lookup_maps, validate_import_rows, stream_csv, \
+    stream_xlsx
+from register import REGISTER_COLUMNS, REGISTER_FROM, COMPACT_COLUMNS, COMPACT_FROM, MAX_PAGE_SIZE, register_filters, \
+    build_register_query, register_etag, paginate, stream_ndjson, folder_subtree, project_folders, load_lookup_names, \
+    lookup_names_version, referenced_lookups
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_pool()
+    await start_listener()
+    blob_gc = asyncio.create_task(garbage_collector())
+    try:
+        yield
+    finally:
+        blob_gc.cancel()
+        await stop_listener()
+        await close_pool()
+        shutdown_password_pool()
+
 
-app = FastAPI()
+# Ответы по умолчанию сериализуются orjson; тяжелые обработчики возвращают ORJSONResponse сами,
+# чтобы не проходить через jsonable_encoder
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+# Все маршруты ниже учитываются в /metrics (число, длительность и выполняемые запросы по шаблону пути)
+app.router.route_class = MetricsRoute
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -23,6 +56,8 @@ origins = [
     "http://localhost:5173",
     "http://127.0.0.1:8080",
 ]
+# Добавляется до CORS, чтобы ранний ответ 413/400 тоже получил заголовки CORS
+app.add_middleware(UploadSizeLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -31,8 +66,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 SECRET_KEY = "your_secret_key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 120
@@ -45,14 +78,17 @@ class UserCreate(BaseModel):
 
 
 async def get_user_by_username(username: str):
-    query = users.select().where(users.c.username == username)
-    return await database.fetch_one(query)
+    async with acquire() as conn:
+        return await fetchrow(conn, 'user_by_username', 'SELECT * FROM users WHERE username = $1', username)
 
 
 async def create_user(user: UserCreate):
-    hashed_password = pwd_context.hash(user.password)
-    query = users.insert().values(username=user.username, password=hashed_password, role_id=user.role_id)
-    user_id = await database.execute(query)  # Capture the inserted user ID
+    hashed_password = await hash_password(user.password)
+    async with acquire() as conn:
+        user_id = await fetchval(conn, 'user_insert', '''
+            INSERT INTO users (username, password, role_id) VALUES ($1, $2, $3) RETURNING id
+        ''', user.username, hashed_password, user.role_id)  # Capture the inserted user ID
+        await notify_change(conn, 'users', user_id)
     return {"id": user_id, "username": user.username, "role_id": user.role_id}  # Return the user data including ID
 
 
@@ -68,8 +104,14 @@ async def authenticate_user(username: str, password: str):
     user = await get_user_by_username(username)
     if not user:
         return False
-    if not pwd_context.verify(password, user['password']):
+    if not await verify_password(password, user['password']):
         return False
+    if needs_rehash(user['password']):
+        # Пароль пользователя уже известен - пересчитываем хэш с текущей стоимостью
+        hashed_password = await hash_password(password)
+        async with acquire() as conn:
+            await execute(conn, 'user_password_update', 'UPDATE users SET password = $2 WHERE id = $1',
+                          user['id'], hashed_password)
     return user
 
 
@@ -106,9 +148,69 @@ async def verify_token(token: str = Depends(oauth2_scheme)):
         username: str = payload.get("sub")
         if username is None:
             raise HTTPException(status_code=403, detail="Token is invalid or expired")
-        return {"username": username}
+        return {"username": username, "id": payload.get("id"), "role_id": payload.get("role_id")}
+    except JWTError:
+        raise HTTPException(status_code=403, detail="Token is invalid or expired")
+
+
+class Principal(BaseModel):
+    id: int
+    username: str
+    role_id: int
+    active: bool
+    project_ids: frozenset[int]
+
+
+async def load_principal(user_id: int):
+    async with acquire() as conn:
+        row = await fetchrow(conn, 'principal_by_id', '''
+            SELECT u.id,
+            u.username,
+            u.role_id,
+            COALESCE(u.active, 1) = 1 active,
+            ARRAY(SELECT upa.project_id FROM user_project_access upa WHERE upa.user_id = u.id) project_ids
+            FROM users u
+            WHERE u.id = $1
+        ''', user_id)
+    if row is None:
+        return None
+    return Principal(**{**row, 'project_ids': frozenset(row['project_ids'])})
+
+
+async def get_current_principal(token: str = Depends(oauth2_scheme)) -> Principal:
+    """Пользователь запроса: id, роль, признак активности и доступные проекты.
+
+    Разрешается один раз на токен и хранится в кэше до истечения токена; деактивация пользователя,
+    смена роли или прав доступа к проектам сбрасывают запись сразу.
+    """
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         raise HTTPException(status_code=403, detail="Token is invalid or expired")
+    user_id = payload.get("id")
+    if user_id is None:
+        raise HTTPException(status_code=403, detail="Token is invalid or expired")
+    key = (user_id, token)
+    principal = principal_cache.get(key)
+    if principal is None:
+        generation = principal_cache.generation(key)
+        principal = await load_principal(user_id)
+        if principal is None:
+            raise HTTPException(status_code=403, detail="Token is invalid or expired")
+        principal_cache.set(key, principal, ttl=payload["exp"] - time.time(), generation=generation)
+    if not principal.active:
+        raise HTTPException(status_code=403, detail="User is deactivated")
+    return principal
+
+
+# Роль «Superuser» (user_roles.id = 1)
+ADMIN_ROLE_ID = 1
+
+
+async def get_admin_principal(principal: Principal = Depends(get_current_principal)) -> Principal:
+    if principal.role_id != ADMIN_ROLE_ID:
+        raise HTTPException(status_code=403, detail="Administrator access required")
+    return principal
 
 
 class PasswordChange(BaseModel):
@@ -123,19 +225,20 @@ async def change_password(password_data: PasswordChange):
     db_user = await get_user_by_id(password_data.user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
-    if not pwd_context.verify(password_data.current_password, db_user['password']):
+    if not await verify_password(password_data.current_password, db_user['password']):
         raise HTTPException(status_code=400, detail="Current password is incorrect")
     if password_data.new_password != password_data.confirm_new_password:
         raise HTTPException(status_code=400, detail="New passwords do not match")
-    hashed_new_password = pwd_context.hash(password_data.new_password)
-    query = users.update().where(users.c.id == db_user['id']).values(password=hashed_new_password)
-    await database.execute(query)
+    hashed_new_password = await hash_password(password_data.new_password)
+    async with acquire() as conn:
+        await execute(conn, 'user_password_update', 'UPDATE users SET password = $2 WHERE id = $1',
+                      db_user['id'], hashed_new_password)
     return {"message": "Password updated successfully"}
 
 
 async def get_user_by_id(user_id: int):
-    query = users.select().where(users.c.id == user_id)
-    return await database.fetch_one(query)
+    async with acquire() as conn:
+        return await fetchrow(conn, 'user_by_id', 'SELECT * FROM users WHERE id = $1', user_id)
 
 
 @app.get("/verify-token/{token}")
@@ -143,134 +246,266 @@ async def verify_user_token(token: str):
     return await verify_token(token=token)
 
 
-@app.on_event("startup")
-async def startup():
-    await database.connect()
+@app.get('/api/db_pool')
+async def get_db_pool():
+    return get_pool_stats()
 
 
-@app.on_event("shutdown")
-async def shutdown():
-    await database.disconnect()
+CACHES = {
+    'reference': reference_cache,
+    'folders': folder_cache,
+    'principals': principal_cache,
+    'register': register_cache,
+}
 
 
-async def db_connect():
-    return await asyncpg.connect(
-        user="postgres",
-        password="123",
-        database="docste",
-        host="localhost"
-    )
+def cache_samples(field):
+    return [((name,), cache.stats()[field]) for name, cache in CACHES.items()]
+
+
+def cache_hit_ratios():
+    samples = []
+    for name, cache in CACHES.items():
+        stats = cache.stats()
+        requests = stats['hits'] + stats['misses']
+        samples.append(((name,), stats['hits'] / requests if requests else 0.0))
+    return samples
+
+
+def pool_samples():
+    stats = get_pool_stats()
+    return [((state,), stats[state]) for state in ('size', 'idle', 'in_use') if state in stats]
+
+
+register_collector('cache_hits_total', 'counter', 'Cache hits', ('cache',), lambda: cache_samples('hits'))
+register_collector('cache_misses_total', 'counter', 'Cache misses', ('cache',), lambda: cache_samples('misses'))
+register_collector('cache_hit_ratio', 'gauge', 'Share of cache lookups served from cache', ('cache',),
+                   cache_hit_ratios)
+register_collector('db_pool_connections', 'gauge', 'Pool connections by state', ('state',), pool_samples)
+
+
+@app.get('/api/admin/slow_queries')
+async def get_slow_query_log(principal: Principal = Depends(get_admin_principal)):
+    """Последние медленные запросы и снятые для них планы EXPLAIN (ANALYZE, BUFFERS)."""
+    return ORJSONResponse(get_slow_queries())
+
+
+@app.get('/metrics', include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(render_metrics(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+async def cached_reference(key, query, *args):
+    """Отдает справочник из кэша уже сериализованным в JSON; при промахе читает из БД."""
+    async def load():
+        async with acquire() as conn:
+            rows = await fetch(conn, f'reference_{key[0]}', query, *args)
+        return dumps(rows)
+
+    body = await reference_cache.get_or_load(key, load)
+    return Response(content=body, media_type='application/json')
+
+
+async def get_lookup_names():
+    async def load():
+        async with acquire() as conn:
+            return await load_lookup_names(conn)
+
+    return await reference_cache.get_or_load(('lookup_names',), load)
+
+
+async def get_lookup_names_version():
+    # Хранится в той же группе, что и названия, и сбрасывается вместе с ними
+    async def load():
+        return lookup_names_version(await get_lookup_names())
+
+    return await reference_cache.get_or_load(('lookup_names', 'version'), load)
 
 
-@alru_cache
 @app.get('/api/data')
-async def get_data(folder_id: int):
+async def get_data(
+        request: Request,
+        folder_id: int,
+        sort: str = 'id',
+        order: str = 'asc',
+        limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+        cursor: str | None = None,
+        format: str = Query('json', pattern='^(json|ndjson|compact)$'),
+        lookups: bool = True,
+        filters: dict = Depends(register_filters),
+):
     try:
-        conn = await db_connect()
-        rows = await conn.fetch(
-            '''
-            SELECT d.id,
-            d.number document_number,
-            d.title document_title,
-            d.title_native document_title_native,
-            d.remarks,
-            p."name" project,
-            di."name" discipline,
-            dt."name" document_type,
-            rs1."name" revision_status,
-            rs2.description revision_step,
-            l."name" language,
-            rd.description revision_description,
-            d.revision_number,
-            TO_CHAR(d.created, 'YYYY-MM-DD HH24:MI:SS') created,
-            CAST(d.modified AS TIMESTAMP) modified
-            FROM documents d
-            LEFT JOIN projects p ON p.id = d.project_id
-            LEFT JOIN disciplines di ON di.id = d.discipline_id
-            LEFT JOIN document_types dt ON dt.id = d.type_id
-            LEFT JOIN revision_statuses rs1 ON rs1.id = d.revision_status_id
-            LEFT JOIN revision_steps rs2 ON rs2.id = d.revision_step_id
-            LEFT JOIN languages l ON l.id = d.language_id
-            LEFT JOIN revision_descriptions rd ON rd.id = d.revision_description_id
-            WHERE d.deleted = 0 AND
-            d.folder_id = $1
-            ORDER BY d.id
-            '''
-            , folder_id)
-        await conn.close()
-        return rows
+        # Версия папки читается до выборки: если документы изменятся во время запроса, ETag останется
+        # старым и клиент перечитает папку в следующий раз
+        async with acquire() as conn:
+            version = await fetchval(conn, 'folder_version', 'SELECT version FROM folders WHERE id = $1', folder_id)
+        headers = {'Cache-Control': 'private, no-cache'}
+        if version is not None:
+            headers['ETag'] = register_etag(folder_id, version, await get_lookup_names_version(),
+                                            request.query_params)
+            if_none_match = request.headers.get('if-none-match')
+            if if_none_match and etag_matches(if_none_match, headers['ETag']):
+                return Response(status_code=304, headers=headers)
+
+        if format == 'ndjson':
+            # Потоковая выгрузка всей папки: строки уходят клиенту по мере чтения из курсора
+            query, args = build_register_query(folder_id, filters, sort, order, cursor, with_sort_key=False)
+            return StreamingResponse(stream_ndjson(query, args), media_type='application/x-ndjson', headers=headers)
+
+        async def render():
+            # compact - id справочников без соединений и один словарь названий (lookups=false - без словаря)
+            compact = format == 'compact'
+            columns, joins = (COMPACT_COLUMNS, COMPACT_FROM) if compact else (REGISTER_COLUMNS, REGISTER_FROM)
+            # Без limit/cursor - прежний формат ответа: весь список документов папки
+            page_size = limit or (MAX_PAGE_SIZE if cursor else None)
+            # Ключ сортировки нужен только для курсора: весь список уходит в orjson как есть, без копирования строк
+            query, args = build_register_query(folder_id, filters, sort, order, cursor, page_size, columns=columns,
+                                               joins=joins, with_sort_key=page_size is not None)
+            async with acquire() as conn:
+                name = 'documents_by_folder_compact' if compact else 'documents_by_folder'
+                rows = await fetch(conn, name, query, *args)
+            if page_size is None:
+                items, next_cursor = rows, None
+            else:
+                items, next_cursor = paginate(rows, sort, order, page_size)
+            if not compact:
+                content = items if page_size is None else {'items': items, 'next_cursor': next_cursor}
+            else:
+                content = {'items': items, 'next_cursor': next_cursor}
+                if lookups:
+                    content['lookups'] = referenced_lookups(items, await get_lookup_names())
+            return dumps(content)
+
+        # Первые страницы и полные списки папок хранятся готовыми байтами вместе со сжатыми вариантами
+        if version is not None and cursor is None:
+            variants = await register_cache.get_or_load((folder_id, version, headers['ETag']), render)
+            return encoded_response(request, variants, headers)
+        return Response(content=await render(), media_type='application/json', headers=headers)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get('/api/search')
+async def search_documents(
+        q: str = Query(..., min_length=2, max_length=256),
+        project_id: int | None = None,
+        limit: int = Query(20, ge=1, le=100),
+        offset: int = Query(0, ge=0, le=10000),
+        principal: Principal = Depends(get_current_principal),
+):
+    """Полнотекстовый поиск по названиям и примечаниям документов во всех доступных пользователю проектах."""
+    try:
+        async with acquire() as conn:
+            rows = await fetch(conn, 'documents_search', '''
+                WITH query AS (
+                    SELECT websearch_to_tsquery('english', $1) || websearch_to_tsquery('russian', $1) q
+                )
+                SELECT d.id,
+                d.number document_number,
+                d.title document_title,
+                d.title_native document_title_native,
+                d.folder_id,
+                f.project_id,
+                ts_rank_cd(d.search_vector, query.q) rank
+                FROM documents d
+                CROSS JOIN query
+                INNER JOIN folders f ON f.id = d.folder_id
+                WHERE d.search_vector @@ query.q AND
+                d.deleted = 0 AND
+                f.deleted = 0 AND
+                f.project_id = ANY($2::int[]) AND
+                ($3::int IS NULL OR f.project_id = $3)
+                ORDER BY rank DESC, d.id
+                LIMIT $4 OFFSET $5
+            ''', q, list(principal.project_ids), project_id, limit + 1, offset)
+        next_offset = offset + limit if len(rows) > limit else None
+        return ORJSONResponse({'items': rows[:limit], 'next_offset': next_offset})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def like_pattern(value):
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+@app.get('/api/documents/autocomplete')
+async def autocomplete_document_number(
+        q: str = Query(..., min_length=3, max_length=128),
+        project_id: int | None = None,
+        limit: int = Query(10, ge=1, le=50),
+):
+    """Подсказки по номеру документа: вхождение подстроки и нечеткие совпадения (pg_trgm).
+
+    Не короче 3 символов: из более короткого шаблона ILIKE нельзя извлечь триграммы,
+    и GIN-индекс пришлось бы просматривать целиком.
+    """
+    try:
+        async with acquire() as conn:
+            rows = await fetch(conn, 'documents_autocomplete', '''
+                SELECT d.id,
+                d.number document_number,
+                d.title document_title,
+                d.folder_id,
+                similarity(d.number, $1) score
+                FROM documents d
+                WHERE d.deleted = 0 AND
+                (d.number ILIKE $2 OR d.number % $1) AND
+                ($3::int IS NULL OR d.folder_id IN (SELECT id FROM folders WHERE project_id = $3))
+                ORDER BY d.number ILIKE $2 DESC, score DESC, d.number
+                LIMIT $4
+            ''', q, like_pattern(q), project_id, limit)
+        return ORJSONResponse(rows)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@alru_cache
 @app.get('/api/disciplines')
 async def get_disciplines():
     try:
-        conn = await db_connect()
-        rows = await conn.fetch(''' SELECT * FROM disciplines ORDER BY id ''')
-        await conn.close()
-        return rows
+        return await cached_reference(('disciplines',), ''' SELECT * FROM disciplines ORDER BY id ''')
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@alru_cache
 @app.get('/api/document_types')
 async def get_document_types():
     try:
-        conn = await db_connect()
-        rows = await conn.fetch(''' SELECT * FROM document_types ORDER BY id ''')
-        await conn.close()
-        return rows
+        return await cached_reference(('document_types',), ''' SELECT * FROM document_types ORDER BY id ''')
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@alru_cache
 @app.get('/api/revision_statuses')
 async def get_revision_statuses():
     try:
-        conn = await db_connect()
-        rows = await conn.fetch(''' SELECT * FROM revision_statuses ORDER BY id ''')
-        await conn.close()
-        return rows
+        return await cached_reference(('revision_statuses',), ''' SELECT * FROM revision_statuses ORDER BY id ''')
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@alru_cache
 @app.get('/api/revision_steps')
 async def get_revision_steps():
     try:
-        conn = await db_connect()
-        rows = await conn.fetch(''' SELECT * FROM revision_steps ORDER BY id ''')
-        await conn.close()
-        return rows
+        return await cached_reference(('revision_steps',), ''' SELECT * FROM revision_steps ORDER BY id ''')
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@alru_cache
 @app.get('/api/revision_descriptions')
 async def get_revision_descriptions():
     try:
-        conn = await db_connect()
-        rows = await conn.fetch(''' SELECT * FROM revision_descriptions ORDER BY id ''')
-        await conn.close()
-        return rows
+        return await cached_reference(('revision_descriptions',), ''' SELECT * FROM revision_descriptions ORDER BY id ''')
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@alru_cache
 @app.get('/api/languages')
 async def get_languages():
     try:
-        conn = await db_connect()
-        rows = await conn.fetch(''' SELECT * FROM languages ORDER BY id ''')
-        await conn.close()
-        return rows
+        return await cached_reference(('languages',), ''' SELECT * FROM languages ORDER BY id ''')
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -278,72 +513,131 @@ async def get_languages():
 @app.post('/api/addnewdoc')
 async def post_addnewdoc(document: dict):
     try:
-        conn = await db_connect()
-        print("Received document:", document)
-        document['discipline'] = int(document['discipline'])
-        document['document_type'] = int(document['document_type'])
-        document['revision_status'] = int(document['revision_status'])
-        document['revision_step'] = int(document['revision_step'])
-        document['revision_description'] = int(document['revision_description'])
-        document['folder_id'] = int(document['folder_id'])
-        document['user_id'] = int(document['user_id'])
-        print("Converted document:", document)
-        query = '''
-            INSERT INTO documents (
-                number,
-                title,
-                title_native,
-                remarks,
-                discipline_id,
-                type_id,
-                revision_status_id,
-                revision_step_id,
-                revision_description_id,
-                language_id,
-                revision_number,
-                folder_id,
-                user_id
+        async with acquire() as conn:
+            print("Received document:", document)
+            document['discipline'] = int(document['discipline'])
+            document['document_type'] = int(document['document_type'])
+            document['revision_status'] = int(document['revision_status'])
+            document['revision_step'] = int(document['revision_step'])
+            document['revision_description'] = int(document['revision_description'])
+            document['folder_id'] = int(document['folder_id'])
+            document['user_id'] = int(document['user_id'])
+            print("Converted document:", document)
+            query = '''
+                INSERT INTO documents (
+                    number,
+                    title,
+                    title_native,
+                    remarks,
+                    discipline_id,
+                    type_id,
+                    revision_status_id,
+                    revision_step_id,
+                    revision_description_id,
+                    language_id,
+                    revision_number,
+                    folder_id,
+                    user_id
+                )
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13)
+                RETURNING id
+            '''
+            result = await fetchrow(conn, 'document_insert',
+                query,
+                document['document_number'],
+                document['document_title'],
+                document['document_title_native'],
+                document['remarks'],
+                document['discipline'],
+                document['document_type'],
+                document['revision_status'],
+                document['revision_step'],
+                document['revision_description'],
+                document['language'],
+                document['revision_number'],
+                document['folder_id'],
+                document['user_id']
             )
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13)
-            RETURNING id
-        '''
-        result = await conn.fetchrow(
-            query,
-            document['document_number'],
-            document['document_title'],
-            document['document_title_native'],
-            document['remarks'],
-            document['discipline'],
-            document['document_type'],
-            document['revision_status'],
-            document['revision_step'],
-            document['revision_description'],
-            document['language'],
-            document['revision_number'],
-            document['folder_id'],
-            document['user_id']
-        )
-        await conn.close()
         return {'message': 'Document added successfully', 'document_id': result['id']}
     except Exception as e:
         print(e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post('/api/import_documents')
+async def import_documents(folder_id: int, user_id: int, file: UploadFile = File(...)):
+    """Массовый импорт реестра документов из CSV/XLSX: все строки или ни одной."""
+    try:
+        data = await file.read()
+        rows = await asyncio.to_thread(read_import_file, data, file.filename)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        async with acquire() as conn:
+            project_id = await fetchval(conn, 'folder_project',
+                                        'SELECT project_id FROM folders WHERE id = $1 AND deleted = 0', folder_id)
+            if project_id is None:
+                raise HTTPException(status_code=404, detail='Папка не найдена')
+            maps = await load_lookup_maps(conn)
+            records, errors = validate_import_rows(rows, maps, project_id, folder_id, user_id)
+            report = {'rows': len(rows), 'imported': 0, 'errors': errors}
+            if errors:
+                return JSONResponse(status_code=422, content=report)
+            async with conn.transaction():
+                await copy_records(conn, 'documents_import', 'documents', records, DOCUMENT_COPY_COLUMNS)
+        report['imported'] = len(records)
+        return report
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get('/api/export')
+async def export_register(
+        folder_id: int | None = None,
+        project_id: int | None = None,
+        subtree: bool = False,
+        format: str = Query('csv', pattern='^(csv|xlsx)$'),
+        sort: str = 'id',
+        order: str = 'asc',
+        filters: dict = Depends(register_filters),
+):
+    """Потоковая выгрузка реестра папки, поддерева папок или всего проекта в CSV/XLSX."""
+    if (folder_id is None) == (project_id is None):
+        raise HTTPException(status_code=400, detail='Укажите folder_id или project_id')
+    async with acquire() as conn:
+        if project_id is not None:
+            scope, folders = f'project_{project_id}', await project_folders(conn, project_id)
+        elif subtree:
+            scope, folders = f'folder_{folder_id}', await folder_subtree(conn, folder_id)
+        else:
+            scope, folders = f'folder_{folder_id}', folder_id
+    query, args = build_register_query(folders, filters, sort, order, with_sort_key=False)
+    if format == 'xlsx':
+        media_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        content = stream_xlsx(query, args)
+    else:
+        media_type = 'text/csv; charset=utf-8'
+        content = stream_csv(query, args)
+    headers = {'Content-Disposition': f'attachment; filename="register_{scope}.{format}"'}
+    return StreamingResponse(content, media_type=media_type, headers=headers)
+
+
 @app.put('/api/upddoc/{id}')
 async def put_upddoc(id: int, update_data: dict):
     try:
-        conn = await db_connect()
-        set_clause = ', '.join([f'{column} = ${i + 2}' for i, (column, value) in enumerate(
-            update_data.items())])  # Создаем строку для запроса UPDATE на основе переданных данных обновления
-        query = f'''
-            UPDATE documents
-            SET {set_clause}
-            WHERE id = $1
-        '''
-        values = [id] + list(update_data.values())  # Формируем список значений для передачи в запрос UPDATE
-        await conn.execute(query, *values)
-        await conn.close()
+        async with acquire() as conn:
+            set_clause = ', '.join([f'{column} = ${i + 2}' for i, (column, value) in enumerate(
+                update_data.items())])  # Создаем строку для запроса UPDATE на основе переданных данных обновления
+            query = f'''
+                UPDATE documents
+                SET {set_clause}
+                WHERE id = $1
+            '''
+            values = [id] + list(update_data.values())  # Формируем список значений для передачи в запрос UPDATE
+            await execute(conn, 'document_update', query, *values)
         return {'message': 'Document updated successfully'}
     except Exception as e:
         print(e)
@@ -353,14 +647,13 @@ async def put_upddoc(id: int, update_data: dict):
 @app.put('/api/deldoc/{id}')
 async def put_deldoc(id: int):
     try:
-        conn = await db_connect()
-        query = '''
-            UPDATE documents
-            SET deleted = 1
-            WHERE id = $1
-        '''
-        await conn.execute(query, id)
-        await conn.close()
+        async with acquire() as conn:
+            query = '''
+                UPDATE documents
+                SET deleted = 1
+                WHERE id = $1
+            '''
+            await execute(conn, 'document_delete', query, id)
         return {'message': 'Document deleted successfully'}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -369,14 +662,13 @@ async def put_deldoc(id: int):
 @app.put('/api/deldocfil/{id}')
 async def put_deldocfil(id: int):
     try:
-        conn = await db_connect()
-        query = '''
-            UPDATE uploaded_files
-            SET deleted = 1
-            WHERE document_id = $1
-        '''
-        await conn.execute(query, id)
-        await conn.close()
+        async with acquire() as conn:
+            query = '''
+                UPDATE uploaded_files
+                SET deleted = 1
+                WHERE document_id = $1
+            '''
+            await execute(conn, 'document_files_delete', query, id)
         return {'message': 'Document files deleted successfully'}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -385,22 +677,28 @@ async def put_deldocfil(id: int):
 @app.post('/api/addfiles')
 async def add_files(document_id: int, files: List[UploadFile] = File(...)):
     try:
+        saved = []
+        records = []
+        remaining = MAX_UPLOAD_REQUEST_SIZE
         for file in files:
-            # Сохраняем файл на сервере
-            path = f'./uploads/{file.filename}'
-            with open(path, 'wb') as buffer:
-                buffer.write(await file.read())
-
-            # Добавляем запись в таблицу document_files
-            conn = await db_connect()
-            query = '''
-                INSERT INTO uploaded_files (document_id, path)
-                VALUES ($1, $2)
-            '''
-            await conn.execute(query, document_id, path)
-            await conn.close()
-
-        return {'message': 'Files added successfully'}
+            # Сохраняем содержимое в хранилище блобов (повторная загрузка того же файла не пишет на диск)
+            file_name = os.path.basename(file.filename)
+            path, size, sha256 = await store_blob(file, min(MAX_UPLOAD_FILE_SIZE, remaining))
+            remaining -= size
+            mime_type = get_mime_type(os.path.splitext(file_name)[1])
+            records.append((document_id, path, sha256, file_name, size, mime_type))
+            saved.append({'file_name': file_name, 'file_size': size, 'sha256': sha256})
+
+        # Все записи uploaded_files одного запроса - одной транзакцией через COPY.
+        # При ошибке ничего не сохраняется, а уже записанные блобы без ссылок подберет сборщик мусора
+        async with acquire() as conn:
+            async with conn.transaction():
+                await copy_records(conn, 'uploaded_files_insert', 'uploaded_files', records,
+                                   ['document_id', 'path', 'sha256', 'file_name', 'file_size', 'mime_type'])
+
+        return {'message': 'Files added successfully', 'files': saved}
+    except HTTPException:
+        raise
     except Exception as e:
         print(e)
         raise HTTPException(status_code=500, detail=str(e))
@@ -418,61 +716,69 @@ class FileData(BaseModel):
 @app.get('/api/getfiles/{document_id}', response_model=List[FileData])
 async def get_files(document_id: int):
     try:
-        conn = await db_connect()
-        query = '''
-            SELECT path
-            FROM uploaded_files
-            WHERE document_id = $1 AND
-            deleted = 0
-        '''
-        rows = await conn.fetch(query, document_id)
-        await conn.close()
+        async with acquire() as conn:
+            query = '''
+                SELECT id, path, file_name, file_size, mime_type
+                FROM uploaded_files
+                WHERE document_id = $1 AND
+                deleted = 0
+            '''
+            rows = await fetch(conn, 'files_by_document', query, document_id)
 
+        # Только чтение из БД: размер и MIME-тип сохранены при загрузке (или командой backfill_files.py)
         files = []
         for row in rows:
             uid = generate_uid()
-            file_name = os.path.basename(row['path'])
-            mime_type = get_mime_type(os.path.splitext(row['path'])[1])
-            file_size = os.path.getsize(row['path'])  # Получаем размер файла в байтах
+            file_name = row['file_name'] or os.path.basename(row['path'])
+            mime_type = row['mime_type'] or get_mime_type(os.path.splitext(file_name)[1])
+            file_size = row['file_size'] or 0
             status = 'done'
-            url = 'http://127.0.0.1:8000/api/files/' + file_name
-            files.append(FileData(uid=uid, file_name=file_name, mime_type=mime_type, file_size=file_size, status=status,
-                                  url=url))
+            url = f'http://127.0.0.1:8000/api/files/{row["id"]}/{quote(file_name)}'
+            files.append({'uid': uid, 'file_name': file_name, 'mime_type': mime_type, 'file_size': file_size,
+                          'status': status, 'url': url})
 
-        return files
+        # Поля уже соответствуют FileData - проверка модели и jsonable_encoder не нужны
+        return ORJSONResponse(files)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get('/api/files/{filename}')
-async def read_uploaded_file(filename: str):
-    file_path = os.path.join('./uploads/', filename)
-    if os.path.exists(file_path):
-        media_type = get_mime_type(os.path.splitext(filename)[1].lower())
-        print(media_type)
-        return FileResponse(file_path, media_type=media_type)
-    else:
+async def read_uploaded_file(filename: str, request: Request):
+    file_path = os.path.join('./uploads/', os.path.basename(filename))
+    media_type = get_mime_type(os.path.splitext(filename)[1].lower())
+    return await send_file(request, file_path, media_type)
+
+
+@app.get('/api/files/{file_id}/{filename}')
+async def read_stored_file(file_id: int, filename: str, request: Request):
+    async with acquire() as conn:
+        row = await fetchrow(conn, 'file_by_id', '''
+            SELECT path, file_name, mime_type, sha256
+            FROM uploaded_files
+            WHERE id = $1 AND
+            deleted = 0
+        ''', file_id)
+    if row is None:
         raise HTTPException(status_code=404, detail='Файл не найден')
+    media_type = row['mime_type'] or get_mime_type(os.path.splitext(row['file_name'] or filename)[1])
+    # Содержимое строки uploaded_files неизменно: сильный ETag из хэша содержимого
+    etag = f'"{row["sha256"]}"' if row['sha256'] else None
+    return await send_file(request, row['path'], media_type, etag=etag, immutable=row['sha256'] is not None)
 
 
-@alru_cache
 @app.get('/api/projects')
 async def get_projects():
     try:
-        conn = await db_connect()
-        rows = await conn.fetch(''' SELECT id, number, name, name_native FROM projects ORDER BY id ''')
-        await conn.close()
-        return rows
+        return await cached_reference(('projects',), ''' SELECT id, number, name, name_native FROM projects ORDER BY id ''')
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get('/api/folders/{project_id}')
-async def get_folders(project_id: int):
-    try:
-        conn = await db_connect()
-        rows = await conn.fetch(''' 
+async def load_folder_tree(project_id):
+    async with acquire() as conn:
+        rows = await fetch(conn, 'folder_tree', ''' 
             WITH RECURSIVE folder_tree AS (
                 SELECT id, name, parent_id
                 FROM folders
@@ -486,20 +792,27 @@ async def get_folders(project_id: int):
             SELECT id, name, parent_id
             FROM folder_tree;
         ''', project_id)
-        await conn.close()
-
-        def build_tree(folders):
-            tree = []
-            lookup = {folder['id']: {**folder, 'title': folder['name'], 'key': folder['id'], 'children': []} for folder
-                      in folders}
-            for folder in folders:
-                if folder['parent_id']:
-                    lookup[folder['parent_id']]['children'].append(lookup[folder['id']])
-                else:
-                    tree.append(lookup[folder['id']])
-            return tree
-
-        return build_tree(rows)
+
+    def build_tree(folders):
+        tree = []
+        lookup = {folder['id']: {**folder, 'title': folder['name'], 'key': folder['id'], 'children': []} for folder
+                  in folders}
+        for folder in folders:
+            if folder['parent_id']:
+                lookup[folder['parent_id']]['children'].append(lookup[folder['id']])
+            else:
+                tree.append(lookup[folder['id']])
+        return tree
+
+    return dumps(build_tree(rows))
+
+
+@app.get('/api/folders/{project_id}')
+async def get_folders(project_id: int):
+    try:
+        # Дерево собирается один раз и хранится сериализованным до изменения папок проекта
+        body = await folder_cache.get_or_load(('folders', project_id), lambda: load_folder_tree(project_id))
+        return Response(content=body, media_type='application/json')
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -507,31 +820,31 @@ async def get_folders(project_id: int):
 @app.post('/api/addfolder')
 async def post_addfolder(folder: dict):
     try:
-        conn = await db_connect()
-        print("Received folder:", folder)
-        if 'parent_id' in folder and folder['parent_id'] is not None:
-            folder['parent_id'] = int(folder['parent_id'])
-        folder['project_id'] = int(folder['project_id'])
-        folder['deleted'] = int(folder['deleted'])
-        print("Converted folder:", folder)
-        query = '''
-            INSERT INTO folders (
-                name,
-                parent_id,
-                project_id,
-                deleted
+        async with acquire() as conn:
+            print("Received folder:", folder)
+            if 'parent_id' in folder and folder['parent_id'] is not None:
+                folder['parent_id'] = int(folder['parent_id'])
+            folder['project_id'] = int(folder['project_id'])
+            folder['deleted'] = int(folder['deleted'])
+            print("Converted folder:", folder)
+            query = '''
+                INSERT INTO folders (
+                    name,
+                    parent_id,
+                    project_id,
+                    deleted
+                )
+                VALUES ($1, $2, $3, $4)
+                RETURNING id
+            '''
+            result = await fetchrow(conn, 'folder_insert',
+                query,
+                folder['name'],
+                folder.get('parent_id'),
+                folder['project_id'],
+                folder['deleted']
             )
-            VALUES ($1, $2, $3, $4)
-            RETURNING id
-        '''
-        result = await conn.fetchrow(
-            query,
-            folder['name'],
-            folder.get('parent_id'),
-            folder['project_id'],
-            folder['deleted']
-        )
-        await conn.close()
+            await notify_change(conn, 'folders', folder['project_id'])
         return {'message': 'Folder added successfully', 'folder_id': result['id']}
     except Exception as e:
         print(e)
@@ -541,22 +854,27 @@ async def post_addfolder(folder: dict):
 @app.put('/api/folders/{folder_id}')
 async def update_folder(folder_id: int, update_data: dict):
     try:
-        conn = await db_connect()
-
-        # Создаем строку для запроса UPDATE на основе переданных данных обновления
-        set_clause = ', '.join([f'{column} = ${i + 2}' for i, (column, value) in enumerate(update_data.items())])
-
-        query = f'''
-            UPDATE folders
-            SET {set_clause}
-            WHERE id = $1
-        '''
+        async with acquire() as conn:
+
+            # Создаем строку для запроса UPDATE на основе переданных данных обновления
+            set_clause = ', '.join([f'{column} = ${i + 2}' for i, (column, value) in enumerate(update_data.items())])
+
+            # old - состояние до UPDATE: папка могла быть перенесена в другой проект
+            query = f'''
+                UPDATE folders
+                SET {set_clause}
+                FROM (SELECT project_id FROM folders WHERE id = $1) old
+                WHERE folders.id = $1
+                RETURNING folders.project_id, old.project_id old_project_id
+            '''
 
-        # Формируем список значений для передачи в запрос UPDATE
-        values = [folder_id] + list(update_data.values())
+            # Формируем список значений для передачи в запрос UPDATE
+            values = [folder_id] + list(update_data.values())
 
-        await conn.execute(query, *values)
-        await conn.close()
+            row = await fetchrow(conn, 'folder_update', query, *values)
+            if row is not None:
+                for project_id in {row['project_id'], row['old_project_id']}:
+                    await notify_change(conn, 'folders', project_id)
 
         return {'message': 'Folder updated successfully'}
     except Exception as e:
@@ -564,17 +882,81 @@ async def update_folder(folder_id: int, update_data: dict):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Мягкое удаление документов и/или папки со всем поддеревом одним запросом.
+# В поддерево входят и ранее удаленные вложенные папки: их содержимое тоже должно быть помечено
+BULK_DELETE_QUERY = '''
+    WITH RECURSIVE subtree AS (
+        SELECT id
+        FROM folders
+        WHERE id = $2
+        UNION ALL
+        SELECT f.id
+        FROM folders f
+        INNER JOIN subtree s ON s.id = f.parent_id
+    ),
+    scope_documents AS (
+        SELECT id
+        FROM documents
+        WHERE id = ANY($1::int[]) OR folder_id IN (SELECT id FROM subtree)
+    ),
+    deleted_folders AS (
+        UPDATE folders
+        SET deleted = 1
+        WHERE id IN (SELECT id FROM subtree) AND deleted = 0
+        RETURNING id, project_id
+    ),
+    deleted_documents AS (
+        UPDATE documents
+        SET deleted = 1
+        WHERE id IN (SELECT id FROM scope_documents) AND deleted = 0
+        RETURNING id
+    ),
+    deleted_files AS (
+        UPDATE uploaded_files
+        SET deleted = 1
+        WHERE document_id IN (SELECT id FROM scope_documents) AND deleted = 0
+        RETURNING id
+    )
+    SELECT (SELECT count(*) FROM deleted_folders) folders,
+    (SELECT count(*) FROM deleted_documents) documents,
+    (SELECT count(*) FROM deleted_files) files,
+    ARRAY(SELECT DISTINCT project_id FROM deleted_folders) project_ids
+'''
+
+
+async def bulk_delete(conn, document_ids=(), folder_id=None):
+    """Помечает удаленными документы, папку с поддеревом и их файлы; возвращает количество затронутых строк."""
+    async with conn.transaction():
+        row = await fetchrow(conn, 'bulk_delete', BULK_DELETE_QUERY, list(document_ids), folder_id)
+    # Кэш деревьев сбрасывается после фиксации, чтобы его не заполнили данными до удаления
+    for project_id in row['project_ids']:
+        await notify_change(conn, 'folders', project_id)
+    return {'folders': row['folders'], 'documents': row['documents'], 'files': row['files']}
+
+
 @app.delete('/api/folders/{folder_id}')
 async def delete_folder(folder_id: int):
     try:
-        conn = await db_connect()
-        await conn.execute('''
-            UPDATE folders 
-            SET deleted = 1 
-            WHERE id = $1
-        ''', folder_id)
-        await conn.close()
-        return {"message": "Folder deleted successfully"}
+        async with acquire() as conn:
+            counts = await bulk_delete(conn, folder_id=folder_id)
+        return {"message": "Folder deleted successfully", **counts}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+class BulkDelete(BaseModel):
+    document_ids: List[int] = []
+    folder_id: int | None = None
+
+
+@app.post('/api/bulk_delete')
+async def post_bulk_delete(request: BulkDelete):
+    if not request.document_ids and request.folder_id is None:
+        raise HTTPException(status_code=400, detail='Укажите document_ids или folder_id')
+    try:
+        async with acquire() as conn:
+            counts = await bulk_delete(conn, request.document_ids, request.folder_id)
+        return {'message': 'Deleted successfully', **counts}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -587,19 +969,18 @@ class DisciplineReference(BaseModel):
 @app.post("/api/save_discipline_references")
 async def save_discipline_references(references: List[DisciplineReference]):
     try:
-        conn = await db_connect()
-        query = '''
-            INSERT INTO project_discipline_doctype_reference (
-                project_id,
-                discipline_id
-            )
-            VALUES ($1, $2)
-            RETURNING id
-        '''
-        async with conn.transaction():
-            for ref in references:
-                await conn.execute(query, ref.project_id, ref.discipline_id)
-        await conn.close()
+        async with acquire() as conn:
+            query = '''
+                INSERT INTO project_discipline_doctype_reference (
+                    project_id,
+                    discipline_id
+                )
+                VALUES ($1, $2)
+                RETURNING id
+            '''
+            async with conn.transaction():
+                for ref in references:
+                    await execute(conn, 'discipline_reference_insert', query, ref.project_id, ref.discipline_id)
         return {'message': 'References added successfully'}
     except Exception as e:
         print(e)
@@ -609,30 +990,27 @@ async def save_discipline_references(references: List[DisciplineReference]):
 @app.get('/api/get_discipline_references/{project_id}')
 async def get_discipline_references(project_id: int):
     try:
-        conn = await db_connect()
-        query = '''
-            SELECT CAST(p.id AS TEXT) AS id,
-                   CAST(p.project_id AS TEXT) AS project_id,
-                   CAST(p.discipline_id AS TEXT) AS discipline_id,
-                   d.code,
-                   d."name"
-            FROM project_discipline_doctype_reference p
-            LEFT JOIN disciplines d ON d.id = p.discipline_id
-            WHERE p.project_id = $1
-        '''
-        rows = await conn.fetch(query, project_id)
-        await conn.close()
-        return rows
+        async with acquire() as conn:
+            query = '''
+                SELECT CAST(p.id AS TEXT) AS id,
+                       CAST(p.project_id AS TEXT) AS project_id,
+                       CAST(p.discipline_id AS TEXT) AS discipline_id,
+                       d.code,
+                       d."name"
+                FROM project_discipline_doctype_reference p
+                LEFT JOIN disciplines d ON d.id = p.discipline_id
+                WHERE p.project_id = $1
+            '''
+            rows = await fetch(conn, 'discipline_references', query, project_id)
+        return ORJSONResponse(rows)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@alru_cache
 @app.get('/api/users')
 async def get_users():
     try:
-        conn = await db_connect()
-        rows = await conn.fetch('''
+        return await cached_reference(('users',), '''
             select u.id,
             u.username,
             u.role_id,
@@ -641,20 +1019,14 @@ async def get_users():
             left join user_roles r on r.id = u.role_id
             where u.active = 1
             ''')
-        await conn.close()
-        return rows
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@alru_cache
 @app.get('/api/roles')
 async def get_roles():
     try:
-        conn = await db_connect()
-        rows = await conn.fetch(''' select * from user_roles ''')
-        await conn.close()
-        return rows
+        return await cached_reference(('roles',), ''' select * from user_roles ''')
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -664,13 +1036,15 @@ class UserUpdate(BaseModel):
 
 
 @app.put("/api/users/{user_id}")
-async def update_user(user_id: int, user_update: UserUpdate, db=Depends(db_connect)):
+async def update_user(user_id: int, user_update: UserUpdate):
     try:
-        await db.execute('''
-            UPDATE users
-            SET role_id = $1
-            WHERE id = $2
-        ''', user_update.role_id, user_id)
+        async with acquire() as conn:
+            await execute(conn, 'user_role_update', '''
+                UPDATE users
+                SET role_id = $1
+                WHERE id = $2
+            ''', user_update.role_id, user_id)
+            await notify_change(conn, 'users', user_id)
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -684,31 +1058,30 @@ class ProjectAccess(BaseModel):
 @app.post("/api/add_users_project_access")
 async def add_users_project_access(references: List[ProjectAccess]):
     try:
-        conn = await db_connect()
-        query = '''
-            INSERT INTO user_project_access (
-                user_id,
-                project_id
-            )
-            VALUES ($1, $2)
-            RETURNING id
-        '''
-        async with conn.transaction():
-            for ref in references:
-                await conn.execute(query, ref.user_id, ref.project_id)
-        await conn.close()
+        async with acquire() as conn:
+            query = '''
+                INSERT INTO user_project_access (
+                    user_id,
+                    project_id
+                )
+                VALUES ($1, $2)
+                RETURNING id
+            '''
+            async with conn.transaction():
+                for ref in references:
+                    await execute(conn, 'user_project_access_insert', query, ref.user_id, ref.project_id)
+                for user_id in {ref.user_id for ref in references}:
+                    await notify_change(conn, 'user_project_access', user_id)
         return {'message': 'References added successfully'}
     except Exception as e:
         print(e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@alru_cache
 @app.get('/api/user_projects')
 async def get_user_projects(id: int = Query(..., description="ID пользователя")):
     try:
-        conn = await db_connect()
-        rows = await conn.fetch('''
+        return await cached_reference(('user_projects', id), '''
             SELECT
             p.id,
             p.number,
@@ -719,8 +1092,6 @@ async def get_user_projects(id: int = Query(..., description="ID пользов
             LEFT JOIN users u ON u.id = upa.user_id
             WHERE u.id = $1
         ''', id)
-        await conn.close()
-        return rows
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -732,28 +1103,29 @@ class UserProjectAccess(BaseModel):
 @app.get("/api/user_project_access/{user_id}", response_model=List[UserProjectAccess])
 async def get_user_project_access(user_id: int):
     try:
-        conn = await db_connect()
-        query = '''
-            SELECT project_id
-            FROM user_project_access
-            WHERE user_id = $1
-        '''
-        result = await conn.fetch(query, user_id)
-        await conn.close()
-        return [{"project_id": row["project_id"]} for row in result]
+        async with acquire() as conn:
+            query = '''
+                SELECT project_id
+                FROM user_project_access
+                WHERE user_id = $1
+            '''
+            result = await fetch(conn, 'user_project_access', query, user_id)
+        return ORJSONResponse(result)
     except Exception as e:
         print(e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.put("/api/user-deactivate/{user_id}")
-async def user_deactivate(user_id: int, db=Depends(db_connect)):
+async def user_deactivate(user_id: int):
     try:
-        await db.execute('''
-            UPDATE users
-            SET active = 0
-            WHERE id = $1
-        ''', user_id)
+        async with acquire() as conn:
+            await execute(conn, 'user_deactivate', '''
+                UPDATE users
+                SET active = 0
+                WHERE id = $1
+            ''', user_id)
+            await notify_change(conn, 'users', user_id)
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
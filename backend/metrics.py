@@ -0,0 +1,171 @@
+"""Метрики в текстовом формате Prometheus (без зависимостей).
+
+Значения хранятся в памяти процесса: при запуске нескольких воркеров каждый отдает свои метрики.
+Запись метрики - несколько операций со словарем, поэтому сбор почти не влияет на время запроса.
+"""
+import time
+from bisect import bisect_left
+from fastapi.routing import APIRoute
+
+# Границы корзин гистограмм (секунды)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+_metrics = []
+_collectors = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        _metrics.append(self)
+
+    def _header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    """Счетчик: рядам и метаданным (HELP/TYPE) добавляется суффикс _total, как в prometheus_client."""
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(f'{name}_total', help, labels)
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self._header()
+        for labels, value in self._values.items():
+            lines.append(f'{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}')
+        return lines
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, *labels):
+        self._values[labels] = self._values.get(labels, 0) + 1
+
+    def dec(self, *labels):
+        self._values[labels] = self._values.get(labels, 0) - 1
+
+    def render(self):
+        lines = self._header()
+        for labels, value in self._values.items():
+            lines.append(f'{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}')
+        return lines
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        # [количество в каждой корзине (без накопления), сумма, количество]
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = self._header()
+        for labels, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, labels)} {count}')
+        return lines
+
+
+def register_collector(name, kind, help, labels, collect):
+    """Метрика, значения которой вычисляются при каждом запросе /metrics.
+
+    collect() возвращает список пар (значения меток, значение) - например, из статистики кэшей.
+    """
+    _collectors.append((name, kind, help, tuple(labels), collect))
+
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for name, kind, help, labels, collect in _collectors:
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} {kind}')
+        for values, value in collect():
+            lines.append(f'{name}{_format_labels(labels, values)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+http_requests = Counter('http_requests', 'HTTP requests by route template and status', ('method', 'route', 'status'))
+http_request_duration = Histogram('http_request_duration_seconds', 'HTTP request latency by route template',
+                                  ('method', 'route'))
+http_requests_in_flight = Gauge('http_requests_in_flight', 'HTTP requests being processed', ('method', 'route'))
+db_query_duration = Histogram('db_query_duration_seconds', 'Database query duration by query name', ('query',),
+                              buckets=DB_BUCKETS)
+db_query_errors = Counter('db_query_errors', 'Failed database queries by query name', ('query',))
+db_acquire_duration = Histogram('db_pool_acquire_seconds', 'Time spent waiting for a pool connection',
+                                buckets=DB_BUCKETS)
+upload_bytes = Counter('upload_bytes', 'Bytes of uploaded files received')
+download_bytes = Counter('download_bytes', 'Bytes of files sent to clients')
+
+
+class MetricsRoute(APIRoute):
+    """Маршрут FastAPI, который учитывает свои запросы: число, длительность и число выполняемых сейчас.
+
+    Метки - метод и шаблон маршрута (например, /api/files/{file_id}/{filename}), поэтому число рядов
+    не зависит от значений параметров. Время включает отправку тела ответа (в т.ч. потокового).
+    """
+
+    async def handle(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await super().handle(scope, receive, send)
+            return
+        method = scope['method']
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        http_requests_in_flight.inc(method, self.path)
+        try:
+            await super().handle(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.dec(method, self.path)
+            http_request_duration.observe(time.perf_counter() - started, method, self.path)
+            http_requests.inc(method, self.path, status)
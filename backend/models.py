@@ -1,4 +1,5 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, Text, func, Table
+from sqlalchemy import BigInteger, Boolean, Column, ForeignKey, Integer, String, DateTime, Text, func, Table, Index, text, Computed
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from database import Base
@@ -150,6 +151,19 @@ class Document(Base):
     language_id = Column(Integer, nullable=False, index=True)
     folder_id = Column(Integer, nullable=False, index=True)
     user_id = Column(Integer, nullable=False, index=True)
+    search_vector = Column(TSVECTOR, Computed(
+        "setweight(to_tsvector('english'::regconfig, coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('russian'::regconfig, coalesce(title_native, '')), 'A') || "
+        "setweight(to_tsvector('english'::regconfig, coalesce(remarks, '')), 'C')",
+        persisted=True))
+
+    __table_args__ = (
+        Index('ix_documents_folder_id_id', 'folder_id', 'id', postgresql_where=text('deleted = 0')),
+        Index('ix_documents_folder_id_number_id', 'folder_id', 'number', 'id', postgresql_where=text('deleted = 0')),
+        Index('ix_documents_search_vector', 'search_vector', postgresql_using='gin'),
+        Index('ix_documents_number_trgm', 'number', postgresql_using='gin', postgresql_ops={'number': 'gin_trgm_ops'},
+              postgresql_where=text('deleted = 0')),
+    )
 
 
 class UserProjectAccess(Base):
@@ -176,6 +190,20 @@ class UploadedFile(Base):
     modified = Column(DateTime(timezone=True))
     deleted = Column(Integer, default=0)
     path = Column(String(2048), index=True)
+    document_id = Column(Integer, index=True)
+    sha256 = Column(String(64), index=True)
+    file_name = Column(String(512))
+    file_size = Column(BigInteger)
+    mime_type = Column(String(255))
+
+
+class FileBlob(Base):
+    __tablename__ = 'file_blobs'
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(BigInteger)
+    ref_count = Column(Integer, nullable=False, default=0, server_default='0')
+    created = Column(DateTime(timezone=True), default=func.now())
+    released = Column(DateTime(timezone=True), default=func.now())
 
 
 class Transmittal(Base):
@@ -200,6 +228,8 @@ class Folder(Base):    # справочник
     parent_id = Column(Integer, nullable=False, index=True)
     project_id = Column(Integer, nullable=False, index=True)
     deleted = Column(Integer, default=0)
+    # Увеличивается триггерами при любом изменении документов папки и их файлов (ETag реестра)
+    version = Column(BigInteger, nullable=False, server_default='0')
 
 
 users = Table(
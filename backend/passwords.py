@@ -0,0 +1,46 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+# Стоимость bcrypt (2^rounds итераций) и размер пула потоков для хэширования
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# Сколько операций может одновременно ждать пул; сверх этого запросы получают 503, а не копятся в очереди
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "32"))
+PASSWORD_HASH_WAIT_TIMEOUT = float(os.getenv("PASSWORD_HASH_WAIT_TIMEOUT", "5"))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# bcrypt отпускает GIL, поэтому хэширование в потоках не блокирует цикл событий
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='bcrypt')
+_pending = asyncio.Semaphore(PASSWORD_HASH_MAX_PENDING)
+
+
+async def _run(func, *args):
+    try:
+        await asyncio.wait_for(_pending.acquire(), PASSWORD_HASH_WAIT_TIMEOUT)
+    except TimeoutError:
+        raise HTTPException(status_code=503, detail='Server is busy, try again later', headers={'Retry-After': '1'})
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+    finally:
+        _pending.release()
+
+
+async def hash_password(password):
+    return await _run(pwd_context.hash, password)
+
+
+async def verify_password(password, hashed):
+    return await _run(pwd_context.verify, password, hashed)
+
+
+def needs_rehash(hashed):
+    # Хэш создан с другой стоимостью (например, после изменения BCRYPT_ROUNDS)
+    return pwd_context.needs_update(hashed)
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,311 @@
+import base64
+import hashlib
+from datetime import date, datetime, time
+from typing import List
+import os
+import orjson
+from fastapi import HTTPException, Query
+from database import acquire, fetch, timed
+from serialization import dumps, strip_sort_key
+
+# Общая часть запроса реестра документов (используется /api/data и производными выборками)
+REGISTER_COLUMNS = '''
+    d.id,
+    d.number document_number,
+    d.title document_title,
+    d.title_native document_title_native,
+    d.remarks,
+    p."name" project,
+    di."name" discipline,
+    dt."name" document_type,
+    rs1."name" revision_status,
+    rs2.description revision_step,
+    l."name" language,
+    rd.description revision_description,
+    d.revision_number,
+    TO_CHAR(d.created, 'YYYY-MM-DD HH24:MI:SS') created,
+    CAST(d.modified AS TIMESTAMP) modified
+'''
+
+REGISTER_FROM = '''
+    FROM documents d
+    LEFT JOIN projects p ON p.id = d.project_id
+    LEFT JOIN disciplines di ON di.id = d.discipline_id
+    LEFT JOIN document_types dt ON dt.id = d.type_id
+    LEFT JOIN revision_statuses rs1 ON rs1.id = d.revision_status_id
+    LEFT JOIN revision_steps rs2 ON rs2.id = d.revision_step_id
+    LEFT JOIN languages l ON l.id = d.language_id
+    LEFT JOIN revision_descriptions rd ON rd.id = d.revision_description_id
+'''
+
+# Компактный формат: документы без соединений со справочниками, только id связанных записей
+COMPACT_COLUMNS = '''
+    d.id,
+    d.number document_number,
+    d.title document_title,
+    d.title_native document_title_native,
+    d.remarks,
+    d.project_id,
+    d.discipline_id,
+    d.type_id document_type_id,
+    d.revision_status_id,
+    d.revision_step_id,
+    d.language_id,
+    d.revision_description_id,
+    d.revision_number,
+    TO_CHAR(d.created, 'YYYY-MM-DD HH24:MI:SS') created,
+    CAST(d.modified AS TIMESTAMP) modified
+'''
+
+COMPACT_FROM = '''
+    FROM documents d
+'''
+
+# Справочники компактного формата: имя словаря -> (поле документа, таблица, отображаемая колонка)
+LOOKUP_NAMES = {
+    'projects': ('project_id', 'projects', 'name'),
+    'disciplines': ('discipline_id', 'disciplines', 'name'),
+    'document_types': ('document_type_id', 'document_types', 'name'),
+    'revision_statuses': ('revision_status_id', 'revision_statuses', 'name'),
+    'revision_steps': ('revision_step_id', 'revision_steps', 'description'),
+    'languages': ('language_id', 'languages', 'name'),
+    'revision_descriptions': ('revision_description_id', 'revision_descriptions', 'description'),
+}
+
+
+# Допустимые ключи сортировки: выражение (не NULL, чтобы работало сравнение кортежей) и тип для курсора
+SORT_KEYS = {
+    'id': ('d.id', 'int'),
+    'number': ('d.number', 'text'),
+    'title': ('d.title', 'text'),
+    'revision_number': ("COALESCE(d.revision_number, '')", 'text'),
+    'created': ("COALESCE(d.created, 'epoch'::timestamptz)", 'timestamptz'),
+    'modified': ("COALESCE(d.modified, d.created, 'epoch'::timestamptz)", 'timestamptz'),
+}
+
+# Фильтры по справочникам: параметр запроса -> колонка documents
+LOOKUP_FILTERS = {
+    'discipline_id': 'd.discipline_id',
+    'type_id': 'd.type_id',
+    'revision_status_id': 'd.revision_status_id',
+    'revision_step_id': 'd.revision_step_id',
+    'language_id': 'd.language_id',
+}
+
+# Фильтры по датам: параметр запроса -> (колонка, оператор)
+DATE_FILTERS = {
+    'created_from': ('d.created', '>='),
+    'created_to': ('d.created', '<='),
+    'modified_from': ('d.modified', '>='),
+    'modified_to': ('d.modified', '<='),
+}
+
+MAX_PAGE_SIZE = 1000
+
+# Сколько строк читать из серверного курсора за раз и отдавать одним куском в потоковом режиме
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", "500"))
+
+
+def register_filters(
+        discipline_id: List[int] | None = Query(None),
+        type_id: List[int] | None = Query(None),
+        revision_status_id: List[int] | None = Query(None),
+        revision_step_id: List[int] | None = Query(None),
+        language_id: List[int] | None = Query(None),
+        created_from: date | datetime | None = None,
+        created_to: date | datetime | None = None,
+        modified_from: date | datetime | None = None,
+        modified_to: date | datetime | None = None,
+):
+    filters = {
+        'discipline_id': discipline_id,
+        'type_id': type_id,
+        'revision_status_id': revision_status_id,
+        'revision_step_id': revision_step_id,
+        'language_id': language_id,
+        'created_from': created_from,
+        'created_to': created_to,
+        'modified_from': modified_from,
+        'modified_to': modified_to,
+    }
+    return {name: value for name, value in filters.items() if value}
+
+
+def _date_bound(name, value):
+    # Дата без времени: "from" - начало дня, "to" - конец дня
+    if isinstance(value, datetime):
+        return value
+    return datetime.combine(value, time.max if name.endswith('_to') else time.min)
+
+
+def encode_cursor(sort, order, key, id):
+    if isinstance(key, datetime):
+        key = key.isoformat()
+    return base64.urlsafe_b64encode(orjson.dumps([sort, order, key, id])).decode()
+
+
+def decode_cursor(cursor, sort, order):
+    try:
+        cursor_sort, cursor_order, key, id = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+    if cursor_sort != sort or cursor_order != order or sort not in SORT_KEYS:
+        raise HTTPException(status_code=400, detail='Cursor does not match sort order')
+    # Курсор приходит от клиента: значения проверяются здесь, а не ошибкой Postgres при выполнении запроса
+    sort_type = SORT_KEYS[sort][1]
+    if not _is_int4(id) or (sort_type == 'int' and not _is_int4(key)) or \
+            (sort_type != 'int' and not isinstance(key, str)):
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+    if sort_type == 'timestamptz':
+        try:
+            key = datetime.fromisoformat(key)
+        except ValueError:
+            raise HTTPException(status_code=400, detail='Invalid cursor')
+    return key, id
+
+
+def _is_int4(value):
+    return isinstance(value, int) and not isinstance(value, bool) and -2 ** 31 <= value < 2 ** 31
+
+
+def register_etag(folder_id, version, names_version, query_params):
+    """ETag выборки реестра: версия папки, версия справочников и хэш параметров запроса.
+
+    Версия папки меняется триггерами при изменении документов и файлов, версия справочников -
+    хэш их названий (lookup_names_version). Обе берутся из данных БД, поэтому все воркеры дают
+    для одного состояния папки один и тот же ETag. Параметры (фильтры, сортировка, курсор, формат)
+    различают варианты ответа.
+    """
+    variant = hashlib.blake2b(orjson.dumps(sorted(query_params.multi_items())), digest_size=8).hexdigest()
+    return f'W/"{folder_id}-{version}-{names_version}-{variant}"'
+
+
+def build_register_query(folder_id, filters=None, sort='id', order='asc', cursor=None, limit=None,
+                         columns=REGISTER_COLUMNS, joins=REGISTER_FROM, with_sort_key=True):
+    """Собирает запрос реестра для папки (или списка папок) с фильтрами и keyset-пагинацией по (ключ сортировки, id).
+
+    Если задан limit, выбирается limit + 1 строка: лишняя строка означает наличие следующей страницы.
+    Значение ключа сортировки возвращается в колонке _sort_key (если with_sort_key).
+    """
+    if sort not in SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f'Unknown sort key: {sort}')
+    if order not in ('asc', 'desc'):
+        raise HTTPException(status_code=400, detail=f'Unknown sort order: {order}')
+    sort_expr, sort_type = SORT_KEYS[sort]
+
+    args = [folder_id]
+    if isinstance(folder_id, int):
+        where = ['d.deleted = 0', 'd.folder_id = $1']
+    else:
+        # Несколько папок (поддерево или весь проект)
+        where = ['d.deleted = 0', 'd.folder_id = ANY($1::int[])']
+    for name, value in (filters or {}).items():
+        if name in LOOKUP_FILTERS:
+            args.append(value)
+            where.append(f'{LOOKUP_FILTERS[name]} = ANY(${len(args)}::int[])')
+        elif name in DATE_FILTERS:
+            column, op = DATE_FILTERS[name]
+            args.append(_date_bound(name, value))
+            where.append(f'{column} {op} ${len(args)}')
+    if cursor:
+        key, id = decode_cursor(cursor, sort, order)
+        args.extend([key, id])
+        op = '>' if order == 'asc' else '<'
+        where.append(f'({sort_expr}, d.id) {op} (${len(args) - 1}::{sort_type}, ${len(args)}::int)')
+
+    if with_sort_key:
+        columns = f'{columns}, {sort_expr} _sort_key'
+    query = f'''
+        SELECT {columns}
+        {joins}
+        WHERE {' AND '.join(where)}
+        ORDER BY {sort_expr} {order}, d.id {order}
+    '''
+    if limit is not None:
+        args.append(limit + 1)
+        query += f' LIMIT ${len(args)}'
+    return query, args
+
+
+async def folder_subtree(conn, folder_id):
+    """Возвращает id папки и всех ее неудаленных вложенных папок."""
+    rows = await fetch(conn, 'folder_subtree', '''
+        WITH RECURSIVE subtree AS (
+            SELECT id
+            FROM folders
+            WHERE id = $1 AND deleted = 0
+            UNION ALL
+            SELECT f.id
+            FROM folders f
+            INNER JOIN subtree s ON s.id = f.parent_id
+            WHERE f.deleted = 0
+        )
+        SELECT id FROM subtree
+    ''', folder_id)
+    return [row['id'] for row in rows]
+
+
+async def project_folders(conn, project_id):
+    rows = await fetch(conn, 'project_folders', 'SELECT id FROM folders WHERE project_id = $1 AND deleted = 0',
+                       project_id)
+    return [row['id'] for row in rows]
+
+
+async def load_lookup_names(conn):
+    """Загружает названия записей всех справочников компактного формата: {словарь: {id: название}}."""
+    names = {}
+    for name, (_, table, column) in LOOKUP_NAMES.items():
+        rows = await fetch(conn, f'lookup_{name}', f'SELECT id, {column} FROM {table}')
+        names[name] = {row['id']: row[column] for row in rows}
+    return names
+
+
+def lookup_names_version(names):
+    """Хэш названий справочников: меняется при любом изменении названий, одинаков во всех процессах."""
+    content = orjson.dumps(names, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(content, digest_size=6).hexdigest()
+
+
+def referenced_lookups(rows, names):
+    """Оставляет в словарях только записи, на которые ссылаются документы выборки."""
+    lookups = {}
+    for name, (field, _, _) in LOOKUP_NAMES.items():
+        ids = {row[field] for row in rows if row[field] is not None}
+        lookups[name] = {id: names[name].get(id) for id in ids}
+    return lookups
+
+
+def paginate(rows, sort, order, limit):
+    """Отрезает лишнюю строку и формирует токен следующей страницы."""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(sort, order, last['_sort_key'], last['id'])
+    return strip_sort_key(rows), next_cursor
+
+
+async def iter_chunks(name, query, args, chunk_rows=STREAM_CHUNK_ROWS):
+    """Читает выборку серверным курсором порциями по chunk_rows строк (общий цикл потоковых выгрузок).
+
+    Каждое чтение порции замеряется под именем name; время отправки клиенту в замер не входит.
+    """
+    async with acquire() as conn:
+        # Курсоры в PostgreSQL живут только внутри транзакции
+        async with conn.transaction(readonly=True):
+            cursor = await conn.cursor(query, *args)
+            while True:
+                async with timed(name):
+                    rows = await cursor.fetch(chunk_rows)
+                if not rows:
+                    break
+                yield rows
+
+
+async def stream_ndjson(query, args, chunk_rows=STREAM_CHUNK_ROWS):
+    """Читает выборку серверным курсором и отдает ее построчно в формате NDJSON.
+
+    Память ограничена одной порцией строк независимо от размера папки.
+    """
+    async for rows in iter_chunks('documents_by_folder_stream', query, args, chunk_rows):
+        yield b''.join(dumps(row) + b'\n' for row in rows)
@@ -0,0 +1,273 @@
+import asyncio
+import csv
+import io
+import os
+import tempfile
+import zipfile
+from xml.etree import ElementTree
+import openpyxl
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils.exceptions import InvalidFileException
+from database import fetch
+from register import STREAM_CHUNK_ROWS, iter_chunks
+
+MAX_IMPORT_ROWS = int(os.getenv("MAX_IMPORT_ROWS", "200000"))
+
+# Колонки файла импорта (совпадают с полями ответа /api/data)
+IMPORT_COLUMNS = [
+    'document_number',
+    'document_title',
+    'document_title_native',
+    'remarks',
+    'discipline',
+    'document_type',
+    'revision_status',
+    'revision_step',
+    'revision_description',
+    'language',
+    'revision_number',
+]
+
+# Справочники: колонка файла -> (таблица, колонки, по которым ищется значение, колонка documents, обязательна)
+IMPORT_LOOKUPS = {
+    'discipline': ('disciplines', ('code', 'name', 'name_native'), 'discipline_id', True),
+    'document_type': ('document_types', ('code', 'name', 'name_native'), 'type_id', True),
+    'revision_status': ('revision_statuses', ('name', 'name_native'), 'revision_status_id', True),
+    'revision_step': ('revision_steps', ('code', 'description', 'description_native'), 'revision_step_id', True),
+    'revision_description': ('revision_descriptions', ('code', 'description', 'description_native'),
+                             'revision_description_id', False),
+    'language': ('languages', ('name', 'name_native'), 'language_id', False),
+}
+
+# Ограничения длины по схеме documents
+MAX_LENGTHS = {
+    'document_number': 128,
+    'document_title': 512,
+    'document_title_native': 512,
+    'revision_number': 8,
+}
+
+# Порядок колонок при загрузке в documents через COPY
+DOCUMENT_COPY_COLUMNS = [
+    'number',
+    'title',
+    'title_native',
+    'remarks',
+    'discipline_id',
+    'type_id',
+    'revision_status_id',
+    'revision_step_id',
+    'revision_description_id',
+    'language_id',
+    'revision_number',
+    'project_id',
+    'folder_id',
+    'user_id',
+]
+
+
+def _normalize(value):
+    if value is None:
+        return ''
+    return str(value).strip()
+
+
+def _read_csv(data):
+    text = io.StringIO(data.decode('utf-8-sig'))
+    sample = text.read(4096)
+    text.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(text, dialect)
+    yield from reader
+
+
+def _read_xlsx(data):
+    workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+# Исключения разборщиков CSV/XLSX на поврежденных файлах
+PARSE_ERRORS = (zipfile.BadZipFile, InvalidFileException, csv.Error, KeyError, ElementTree.ParseError)
+
+
+def read_import_file(data, filename):
+    """Читает CSV или XLSX и возвращает список словарей по колонкам IMPORT_COLUMNS.
+
+    Первая строка - заголовок; неизвестные колонки игнорируются. Ошибки разбора файла
+    (поврежденный архив XLSX, неверный CSV) поднимаются как ValueError - это ошибка данных клиента.
+    """
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.xlsx':
+        rows = _read_xlsx(data)
+    elif extension in ('.csv', '.txt'):
+        rows = _read_csv(data)
+    else:
+        raise ValueError('Поддерживаются только файлы CSV и XLSX')
+    try:
+        return _parse_rows(rows)
+    except PARSE_ERRORS as e:
+        raise ValueError(f'Не удалось прочитать файл: {e}') from e
+
+
+def _parse_rows(rows):
+    header = [_normalize(column).lower() for column in next(rows, [])]
+    missing = [column for column in ('document_number', 'document_title') if column not in header]
+    if missing:
+        raise ValueError(f'В файле нет обязательных колонок: {", ".join(missing)}')
+    positions = {column: header.index(column) for column in IMPORT_COLUMNS if column in header}
+
+    result = []
+    for row in rows:
+        if row is None or all(_normalize(value) == '' for value in row):
+            continue
+        if len(result) >= MAX_IMPORT_ROWS:
+            raise ValueError(f'Файл содержит больше {MAX_IMPORT_ROWS} строк')
+        result.append({column: _normalize(row[index]) if index < len(row) else ''
+                       for column, index in positions.items()})
+    return result
+
+
+async def load_lookup_maps(conn):
+    """Загружает справочники и строит словари «значение в нижнем регистре -> id» для всех колонок поиска."""
+    maps = {}
+    for column, (table, fields, _, _) in IMPORT_LOOKUPS.items():
+        rows = await fetch(conn, f'import_lookup_{table}', f'SELECT id, {", ".join(fields)} FROM {table}')
+        lookup = {}
+        for row in rows:
+            for field in fields:
+                if row[field]:
+                    lookup.setdefault(row[field].strip().lower(), row['id'])
+        maps[column] = lookup
+    return maps
+
+
+def validate_import_rows(rows, maps, project_id, folder_id, user_id):
+    """Проверяет строки импорта и переводит названия справочников в id.
+
+    Возвращает (records, errors): записи для COPY в порядке DOCUMENT_COPY_COLUMNS и список ошибок
+    вида {'row': номер строки файла, 'errors': [...]}.
+    """
+    records = []
+    errors = []
+    seen_numbers = {}
+    for index, row in enumerate(rows, start=2):
+        row_errors = []
+        number = row.get('document_number', '')
+        if not number:
+            row_errors.append('document_number: обязательное поле')
+        elif number in seen_numbers:
+            row_errors.append(f'document_number: повторяется в строке {seen_numbers[number]}')
+        else:
+            seen_numbers[number] = index
+        if not row.get('document_title'):
+            row_errors.append('document_title: обязательное поле')
+        for column, limit in MAX_LENGTHS.items():
+            if len(row.get(column, '')) > limit:
+                row_errors.append(f'{column}: длиннее {limit} символов')
+
+        ids = {}
+        for column, (_, _, target, required) in IMPORT_LOOKUPS.items():
+            value = row.get(column, '')
+            if not value:
+                if required:
+                    row_errors.append(f'{column}: обязательное поле')
+                ids[target] = None
+                continue
+            ids[target] = maps[column].get(value.lower())
+            if ids[target] is None:
+                row_errors.append(f'{column}: неизвестное значение "{value}"')
+
+        if row_errors:
+            errors.append({'row': index, 'document_number': number, 'errors': row_errors})
+            continue
+        records.append((
+            number,
+            row['document_title'],
+            row.get('document_title_native') or None,
+            row.get('remarks') or None,
+            ids['discipline_id'],
+            ids['type_id'],
+            ids['revision_status_id'],
+            ids['revision_step_id'],
+            ids['revision_description_id'],
+            ids['language_id'],
+            row.get('revision_number') or None,
+            project_id,
+            folder_id,
+            user_id,
+        ))
+    return records, errors
+
+
+# Колонки выгрузки реестра (поля выборки /api/data; заголовок совместим с импортом)
+EXPORT_COLUMNS = [
+    'id',
+    'document_number',
+    'document_title',
+    'document_title_native',
+    'remarks',
+    'project',
+    'discipline',
+    'document_type',
+    'revision_status',
+    'revision_step',
+    'language',
+    'revision_description',
+    'revision_number',
+    'created',
+    'modified',
+]
+
+
+async def stream_csv(query, args, chunk_rows=STREAM_CHUNK_ROWS):
+    """Выгружает реестр в CSV по мере чтения из курсора; память ограничена одной порцией строк."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM, чтобы Excel открыл UTF-8 без мастера импорта
+    buffer.write('\ufeff')
+    writer.writerow(EXPORT_COLUMNS)
+    async for rows in iter_chunks('register_export', query, args, chunk_rows):
+        writer.writerows([[row[column] for column in EXPORT_COLUMNS] for row in rows])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _cell(value):
+    # Управляющие символы (встречаются в названиях из старых данных) недопустимы в XML книги
+    return ILLEGAL_CHARACTERS_RE.sub('', value) if isinstance(value, str) else value
+
+
+def _append_rows(sheet, rows):
+    for row in rows:
+        sheet.append([_cell(row[column]) for column in EXPORT_COLUMNS])
+
+
+def _read_chunk(f, size):
+    return f.read(size)
+
+
+async def stream_xlsx(query, args, chunk_rows=STREAM_CHUNK_ROWS, chunk_size=256 * 1024):
+    """Выгружает реестр в XLSX через write-only режим openpyxl.
+
+    Строки пишутся во временные файлы openpyxl по мере чтения из курсора, поэтому память постоянна.
+    Формат ZIP требует дописать книгу до конца, поэтому отдача начинается после сохранения.
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Register')
+    sheet.append(EXPORT_COLUMNS)
+    async for rows in iter_chunks('register_export', query, args, chunk_rows):
+        await asyncio.to_thread(_append_rows, sheet, rows)
+    with tempfile.TemporaryFile() as f:
+        await asyncio.to_thread(workbook.save, f)
+        await asyncio.to_thread(f.seek, 0)
+        while chunk := await asyncio.to_thread(_read_chunk, f, chunk_size):
+            yield chunk
@@ -0,0 +1,156 @@
+import asyncio
+import gzip
+import os
+from collections import OrderedDict
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Общий объем кэша готовых ответов реестра и предел для одного ответа (байты, вместе со сжатыми вариантами)
+REGISTER_CACHE_MAX_BYTES = int(os.getenv("REGISTER_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+REGISTER_CACHE_MAX_ENTRY_BYTES = int(os.getenv("REGISTER_CACHE_MAX_ENTRY_BYTES", str(32 * 1024 * 1024)))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+# Ответы меньше этого размера не сжимаются
+COMPRESS_MIN_SIZE = 1024
+
+
+def compress_variants(body):
+    """Возвращает словарь «кодировка -> байты»: исходный JSON и, для крупных ответов, gzip и br."""
+    variants = {'identity': body}
+    if len(body) >= COMPRESS_MIN_SIZE:
+        variants['gzip'] = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+        if brotli is not None:
+            variants['br'] = brotli.compress(body, quality=BROTLI_QUALITY)
+    return variants
+
+
+def _accepted_encodings(header):
+    accepted = set()
+    for item in (header or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        q = params.strip().removeprefix('q=')
+        try:
+            if params and float(q) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+def encoded_response(request, variants, headers, media_type='application/json'):
+    """Отдает подходящий клиенту вариант из кэша: br, затем gzip, иначе несжатый JSON."""
+    accepted = _accepted_encodings(request.headers.get('accept-encoding'))
+    headers = {**headers, 'Vary': 'Accept-Encoding'}
+    for coding in ('br', 'gzip'):
+        if coding in variants and coding in accepted:
+            headers['Content-Encoding'] = coding
+            return Response(content=variants[coding], media_type=media_type, headers=headers)
+    return Response(content=variants['identity'], media_type=media_type, headers=headers)
+
+
+class ResponseCache:
+    """LRU-кэш готовых ответов по папкам с ограничением по суммарному объему в байтах.
+
+    Ключ - (folder_id, version, variant): версия папки меняется триггерами при любом изменении
+    ее документов и файлов, поэтому после записи старые ответы больше не находятся. Как только
+    встречается более новая версия папки, ее старые ответы удаляются сразу, не дожидаясь вытеснения.
+    """
+
+    def __init__(self, max_bytes, max_entry_bytes):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._folders = {}
+        self._versions = {}
+        self._loading = {}
+
+    def _advance(self, folder_id, version):
+        """Удаляет ответы папки для версий старше version; False - если version сама устарела."""
+        known = self._versions.get(folder_id)
+        if known is not None and known < version:
+            for key in list(self._folders.get(folder_id, ())):
+                self._remove(key)
+        return known is None or known <= version
+
+    def _remove(self, key):
+        variants = self._data.pop(key, None)
+        if variants is None:
+            return
+        self.size -= sum(len(body) for body in variants.values())
+        keys = self._folders.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._folders[key[0]]
+                self._versions.pop(key[0], None)
+
+    def get(self, key):
+        self._advance(key[0], key[1])
+        variants = self._data.get(key)
+        if variants is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return variants
+
+    def set(self, key, variants):
+        size = sum(len(body) for body in variants.values())
+        # Ответ устарел, пока строился, или слишком велик для кэша
+        if not self._advance(key[0], key[1]) or size > self.max_entry_bytes:
+            return
+        self._remove(key)
+        self._data[key] = variants
+        self._folders.setdefault(key[0], set()).add(key)
+        self._versions[key[0]] = key[1]
+        self.size += size
+        while self.size > self.max_bytes and self._data:
+            self._remove(next(iter(self._data)))
+
+    async def get_or_load(self, key, loader):
+        """Возвращает варианты ответа из кэша, а при промахе строит их: loader() дает байты JSON.
+
+        Одновременные открытия одной папки ждут одно построение; сжатие выполняется вне цикла событий.
+        """
+        variants = self.get(key)
+        if variants is not None:
+            return variants
+        task = self._loading.get(key)
+        if task is None:
+            async def load():
+                return await asyncio.to_thread(compress_variants, await loader())
+
+            task = asyncio.create_task(load())
+            self._loading[key] = task
+
+            def done(task):
+                if self._loading.get(key) is task:
+                    del self._loading[key]
+                if not task.cancelled() and task.exception() is None:
+                    self.set(key, task.result())
+
+            task.add_done_callback(done)
+        return await asyncio.shield(task)
+
+    def clear(self):
+        self._data.clear()
+        self._folders.clear()
+        self._versions.clear()
+        self._loading.clear()
+        self.size = 0
+
+    def stats(self):
+        return {"entries": len(self._data), "bytes": self.size, "max_bytes": self.max_bytes, "hits": self.hits,
+                "misses": self.misses, "brotli": brotli is not None}
+
+
+# Ответы /api/data: ключ (folder_id, folders.version, ETag варианта запроса)
+register_cache = ResponseCache(REGISTER_CACHE_MAX_BYTES, REGISTER_CACHE_MAX_ENTRY_BYTES)
@@ -0,0 +1,38 @@
+from decimal import Decimal
+import asyncpg
+import orjson
+from starlette.responses import JSONResponse
+
+
+def _default(obj):
+    # Record превращается в словарь по одному прямо во время сериализации - без промежуточного списка
+    if isinstance(obj, asyncpg.Record):
+        return dict(obj)
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f'Type is not JSON serializable: {type(obj).__name__}')
+
+
+# Сериализует ответ (в т.ч. списки asyncpg.Record) сразу в байты JSON
+def dumps(obj):
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def loads(data):
+    return orjson.loads(data)
+
+
+# Строки выборки с ключом keyset-пагинации -> словари без служебной колонки _sort_key
+def strip_sort_key(rows):
+    return [{key: value for key, value in row.items() if key != '_sort_key'} for row in rows]
+
+
+class ORJSONResponse(JSONResponse):
+    """Ответ JSON через orjson; понимает asyncpg.Record, Decimal и даты.
+
+    Обработчик, который возвращает такой ответ сам, минует jsonable_encoder FastAPI:
+    строки из БД сериализуются в байты за один проход.
+    """
+
+    def render(self, content):
+        return dumps(content)
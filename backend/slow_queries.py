@@ -0,0 +1,102 @@
+"""Журнал медленных запросов и выборочный сбор их планов (EXPLAIN ANALYZE).
+
+Запросы, выполняемые через database.fetch/fetchrow/fetchval/execute, дольше SLOW_QUERY_THRESHOLD
+пишутся в лог с именем, длительностью и обезличенными параметрами. Для доли SLOW_QUERY_EXPLAIN_SAMPLE
+из них (только чтение) в фоне снимается план EXPLAIN (ANALYZE, BUFFERS) в откатываемой транзакции.
+Планы сохраняются в файл JSON Lines и в памяти - последние SLOW_QUERY_KEEP штук.
+"""
+import asyncio
+import logging
+import os
+import random
+import re
+from collections import deque
+from datetime import date, datetime, timezone
+from serialization import dumps, loads
+
+SLOW_QUERY_THRESHOLD = float(os.getenv("SLOW_QUERY_THRESHOLD", "0.5"))
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", "0.1"))
+# Предел времени на повторное выполнение запроса под EXPLAIN ANALYZE (секунды)
+SLOW_QUERY_EXPLAIN_TIMEOUT = float(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT", "30"))
+SLOW_QUERY_PLAN_FILE = os.getenv("SLOW_QUERY_PLAN_FILE", "./logs/slow_query_plans.jsonl")
+SLOW_QUERY_KEEP = int(os.getenv("SLOW_QUERY_KEEP", "100"))
+
+logger = logging.getLogger(__name__)
+
+slow_statements = deque(maxlen=SLOW_QUERY_KEEP)
+captured_plans = deque(maxlen=SLOW_QUERY_KEEP)
+
+# EXPLAIN ANALYZE выполняет запрос на самом деле, поэтому планы снимаются только для чтения
+_WRITE_STATEMENT = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE|COPY|CREATE|ALTER|DROP|CALL)\b|\bpg_notify\b',
+                              re.IGNORECASE)
+_SPACES = re.compile(r'\s+')
+
+# Одновременно снимается не больше одного плана: при перегрузке БД сбор планов ее не усугубляет
+_capture = None
+
+
+def redact(value):
+    """Параметры в журнале: числа, даты и логические значения как есть, строки и списки - только длина."""
+    if value is None or isinstance(value, (bool, int, float, date, datetime)):
+        return value
+    if isinstance(value, str):
+        return f'<str len={len(value)}>'
+    if isinstance(value, (list, tuple)):
+        return f'<{type(value).__name__} len={len(value)}>'
+    return f'<{type(value).__name__}>'
+
+
+def is_read_only(query):
+    return _WRITE_STATEMENT.search(query) is None
+
+
+def record_slow_query(name, query, args, elapsed):
+    entry = {
+        'name': name,
+        'duration_ms': round(elapsed * 1000, 1),
+        'params': [redact(arg) for arg in args],
+        'at': datetime.now(timezone.utc),
+    }
+    slow_statements.append(entry)
+    logger.warning('Slow query %s: %.1f ms, params=%s', name, entry['duration_ms'], entry['params'])
+
+    global _capture
+    if (random.random() < SLOW_QUERY_EXPLAIN_SAMPLE and is_read_only(query) and
+            (_capture is None or _capture.done())):
+        _capture = asyncio.get_running_loop().create_task(capture_plan(entry, query, args))
+
+
+def _append_plan(path, line):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'ab') as f:
+        f.write(line + b'\n')
+
+
+async def capture_plan(entry, query, args):
+    """Выполняет запрос под EXPLAIN (ANALYZE, BUFFERS) на отдельном соединении и откатывает транзакцию."""
+    # database импортирует этот модуль, поэтому пул берется при вызове
+    from database import acquire
+    try:
+        async with acquire() as conn:
+            transaction = conn.transaction(readonly=True)
+            await transaction.start()
+            try:
+                await conn.execute(f"SET LOCAL statement_timeout = {int(SLOW_QUERY_EXPLAIN_TIMEOUT * 1000)}")
+                plan = await conn.fetchval(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}', *args)
+            finally:
+                await transaction.rollback()
+        record = {**entry, 'query': _SPACES.sub(' ', query).strip(), 'plan': loads(plan)}
+        captured_plans.append(record)
+        if SLOW_QUERY_PLAN_FILE:
+            await asyncio.to_thread(_append_plan, SLOW_QUERY_PLAN_FILE, dumps(record))
+    except Exception as e:
+        logger.warning('Could not capture plan for %s: %s', entry['name'], e)
+
+
+def get_slow_queries():
+    return {
+        'threshold_ms': SLOW_QUERY_THRESHOLD * 1000,
+        'explain_sample': SLOW_QUERY_EXPLAIN_SAMPLE,
+        'statements': list(slow_statements),
+        'plans': list(captured_plans),
+    }
@@ -0,0 +1,187 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+from database import acquire, fetch, execute
+from metrics import upload_bytes
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "./uploads")
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+MAX_UPLOAD_FILE_SIZE = int(os.getenv("MAX_UPLOAD_FILE_SIZE", str(1024 * 1024 * 1024)))
+MAX_UPLOAD_REQUEST_SIZE = int(os.getenv("MAX_UPLOAD_REQUEST_SIZE", str(4 * 1024 * 1024 * 1024)))
+
+# Хранилище блобов: ./uploads/blobs/ab/cd/abcd... (имя файла - SHA-256 содержимого)
+BLOB_DIR = os.path.join(UPLOAD_DIR, "blobs")
+BLOB_GC_INTERVAL = float(os.getenv("BLOB_GC_INTERVAL", "3600"))
+BLOB_GC_GRACE = float(os.getenv("BLOB_GC_GRACE", "3600"))
+
+logger = logging.getLogger(__name__)
+
+# Пути, на которые распространяется ограничение размера тела запроса
+UPLOAD_PATHS = ('/api/addfiles',)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _hash_chunk(digest, chunk):
+    digest.update(chunk)
+
+
+def blob_path(sha256):
+    return os.path.join(BLOB_DIR, sha256[:2], sha256[2:4], sha256)
+
+
+async def hash_upload(file, max_size=MAX_UPLOAD_FILE_SIZE):
+    """Считает размер и SHA-256 загруженного файла одним проходом по порциям.
+
+    Прерывается с 413, как только файл превышает max_size. Возвращает (size, sha256).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    await file.seek(0)
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_size:
+            raise HTTPException(status_code=413, detail=f'Файл {file.filename} превышает допустимый размер')
+        await asyncio.to_thread(_hash_chunk, digest, chunk)
+    return size, digest.hexdigest()
+
+
+async def copy_upload(file, path):
+    """Записывает загруженный файл на диск порциями, не блокируя цикл событий.
+
+    Файл пишется во временный .part и переименовывается только после успешной записи.
+    """
+    part_path = f'{path}.{uuid.uuid4().hex}.part'
+    await asyncio.to_thread(os.makedirs, os.path.dirname(path), exist_ok=True)
+    buffer = await asyncio.to_thread(open, part_path, 'wb')
+    try:
+        await file.seek(0)
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            await asyncio.to_thread(buffer.write, chunk)
+        await asyncio.to_thread(buffer.close)
+        await asyncio.to_thread(os.replace, part_path, path)
+    except BaseException:
+        await asyncio.to_thread(buffer.close)
+        await asyncio.to_thread(_remove, part_path)
+        raise
+
+
+def _touch_blob(path):
+    # Обновляем mtime, чтобы сборщик мусора не удалил блоб, на который сейчас появляется ссылка
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+async def store_blob(file, max_size=MAX_UPLOAD_FILE_SIZE):
+    """Сохраняет загруженный файл в хранилище, адресуемое по содержимому (SHA-256).
+
+    Если такой блоб уже есть, запись на диск пропускается. Строка file_blobs регистрируется
+    до записи файла, поэтому блоб, на который так и не сослались, подберет сборщик мусора.
+    Возвращает (path, size, sha256).
+    """
+    size, sha256 = await hash_upload(file, max_size)
+    upload_bytes.inc(amount=size)
+    path = blob_path(sha256)
+    async with acquire() as conn:
+        await execute(conn, 'blob_register', '''
+            INSERT INTO file_blobs (sha256, size)
+            VALUES ($1, $2)
+            ON CONFLICT (sha256) DO NOTHING
+        ''', sha256, size)
+    if not await asyncio.to_thread(_touch_blob, path):
+        await copy_upload(file, path)
+    return path, size, sha256
+
+
+def _sweep_blob(path, grace):
+    try:
+        if time.time() - os.path.getmtime(path) > grace:
+            os.remove(path)
+            return True
+    except FileNotFoundError:
+        pass
+    return False
+
+
+async def collect_garbage(grace=BLOB_GC_GRACE):
+    """Удаляет блобы, на которые дольше grace секунд не ссылается ни одна строка uploaded_files.
+
+    Мягко удаленные файлы (deleted = 1) остаются ссылками, поэтому их содержимое можно восстановить.
+    """
+    async with acquire() as conn:
+        rows = await fetch(conn, 'blob_gc', '''
+            DELETE FROM file_blobs
+            WHERE ref_count <= 0 AND
+            released < now() - make_interval(secs => $1)
+            RETURNING sha256
+        ''', grace)
+    removed = 0
+    for row in rows:
+        removed += await asyncio.to_thread(_sweep_blob, blob_path(row['sha256']), grace)
+    return removed
+
+
+async def garbage_collector(interval=BLOB_GC_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            removed = await collect_garbage()
+            if removed:
+                logger.info('Blob GC: removed %d unreferenced blobs', removed)
+        except Exception:
+            logger.exception('Blob GC failed')
+
+
+class UploadSizeLimitMiddleware:
+    """Прерывает загрузку, как только тело запроса превышает MAX_UPLOAD_REQUEST_SIZE.
+
+    FastAPI разбирает multipart до вызова обработчика, поэтому лимит на запрос проверяется здесь:
+    сначала по Content-Length, затем по фактически полученным байтам.
+    """
+
+    def __init__(self, app, max_size=MAX_UPLOAD_REQUEST_SIZE, paths=UPLOAD_PATHS):
+        self.app = app
+        self.max_size = max_size
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        for name, value in scope['headers']:
+            if name != b'content-length':
+                continue
+            if not value.isdigit():
+                response = JSONResponse({'detail': 'Invalid Content-Length'}, status_code=400)
+                await response(scope, receive, send)
+                return
+            if int(value) > self.max_size:
+                response = JSONResponse({'detail': 'Request body is too large'}, status_code=413)
+                await response(scope, receive, send)
+                return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.max_size:
+                    raise HTTPException(status_code=413, detail='Request body is too large')
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,34 @@
+import io
+import os
+import zipfile
+
+os.environ.setdefault('DB_URL', 'postgresql://postgres@localhost:5432/docste')
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from main import app  # noqa: E402
+from register_io import read_import_file  # noqa: E402
+
+XLSX_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def corrupt_workbooks():
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as z:
+        z.writestr('readme.txt', 'not a workbook')
+    return [b'not a zip', b'PK\x03\x04truncated', archive.getvalue()]
+
+
+@pytest.mark.parametrize('data', corrupt_workbooks())
+def test_read_import_file_rejects_corrupt_workbook(data):
+    with pytest.raises(ValueError):
+        read_import_file(data, 'register.xlsx')
+
+
+@pytest.mark.parametrize('data', corrupt_workbooks())
+def test_import_corrupt_workbook_returns_400(data):
+    # Файл разбирается до обращения к базе, поэтому пул и lifespan не нужны
+    client = TestClient(app)
+    response = client.post('/api/import_documents', params={'folder_id': 1, 'user_id': 1},
+                           files={'file': ('register.xlsx', data, XLSX_TYPE)})
+    assert response.status_code == 400